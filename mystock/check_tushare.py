@@ -4,6 +4,7 @@
 import tushare as ts
 import inspect
 import os
+import providers
 
 print("=" * 60)
 print("Tushare深度检查")
@@ -29,7 +30,7 @@ print("\n测试调用pro.daily:")
 try:
     pro = ts.pro_api()
     # 使用正确的参数格式
-    data = pro.daily(ts_code='000001.SZ', trade_date='20240130')
+    data = providers.call('tushare', 'daily', pro.daily, ts_code='000001.SZ', trade_date='20240130')
     print(f"返回数据类型: {type(data)}")
     if hasattr(data, 'shape'):
         print(f"数据形状: {data.shape}")
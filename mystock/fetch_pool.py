@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+# fetch_pool.py
+
+import threading
+import time
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# 各数据源每分钟请求配额（tushare daily 普通积分为500次/分钟，留一点余量）
+AKSHARE_PER_MIN = 300
+TUSHARE_PER_MIN = 450
+FETCH_WORKERS = 8
+
+class TokenBucket:
+    """令牌桶限流器，多线程共享"""
+
+    def __init__(self, per_minute, burst=None):
+        """
+        参数:
+        per_minute: 每分钟允许的请求数
+        burst: 桶容量，默认为每分钟配额的1/10
+        """
+        self.rate = per_minute / 60.0
+        self.capacity = burst if burst else max(1, per_minute // 10)
+        self.tokens = float(self.capacity)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, n=1):
+        """取n个令牌，不够时阻塞等待"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                wait_time = (n - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+limiters = {
+    'akshare': TokenBucket(AKSHARE_PER_MIN),
+    'tushare': TokenBucket(TUSHARE_PER_MIN),
+}
+
+def fetch_all(items, fetch, workers=FETCH_WORKERS, backlog=None):
+    """
+    用有界线程池并发执行 fetch(item)，按完成顺序 yield (item, result, error)
+
+    同时在途的任务不超过 backlog 个，调用方处理完一个结果才会提交下一个，
+    避免全市场拉取时结果在内存里堆积
+    """
+    backlog = backlog or workers * 2
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(fetch, item): item for item in islice(items, backlog)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                item = pending.pop(fut)
+                for nxt in islice(items, 1):
+                    pending[pool.submit(fetch, nxt)] = nxt
+                try:
+                    result, error = fut.result(), None
+                except Exception as e:
+                    result, error = None, e
+                yield item, result, error
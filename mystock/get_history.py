@@ -1,64 +1,112 @@
 #!/usr/bin/python3
 
-import pandas as pd
 import tushare as ts
-from datetime import datetime as dt, timedelta
+from datetime import datetime as dt
 import sys
-import time
+import os
 import argparse
+from pathlib import Path
+from trade_cal import TradeCalendar
+from market_db import MarketDB, DB_FILE
+import providers
 
 ts.set_token('5c940b85806741e9a4aedd3495a9fd43c11a0542d4b3ad641c1ef949')
 pro = ts.pro_api()
-
-date_add_one = lambda d: (dt.strptime(d, '%Y%m%d') + timedelta(days=1)).strftime('%Y%m%d')
+cal = TradeCalendar(pro=pro)
 
 class GetHistory:
-    def __init__(self, start_date, end_date):
-        self.res = []
-        file_name = f'history_{start_date}_{end_date}.csv'
+    """
+    按交易日回补全市场日线
+    每天的数据一拿到就写成分区文件并记入checkpoint，中断后重跑会跳过已完成的日期，
+    最后按日期顺序把分区流式拼接成 history_{start}_{end}.csv
+    传入db时每天的数据同时批量写入行情库的bars表
+    """
+    def __init__(self, start_date, end_date, db=None):
+        self.db = db
+        self.file_name = f'history_{start_date}_{end_date}.csv'
+        self.part_dir = Path(f'history_{start_date}_{end_date}.parts')
+        self.part_dir.mkdir(exist_ok=True)
+        self.done_file = self.part_dir / '_done.txt'
+        self.done = self.load_done()
         self.get_history(start_date, end_date)
-        
-        # 修复：正确合并数据
-        all_dfs = []
-        for date_str, df in self.res:
-            if df is not None and not df.empty:
-                all_dfs.append(df)
-        
-        if all_dfs:
-            result_df = pd.concat(all_dfs, ignore_index=True)
-            result_df.to_csv(file_name, index=False, encoding='utf-8-sig')
-            print(f"数据已保存到 {file_name}，共 {len(result_df)} 条记录")
-        else:
-            print("没有获取到数据")
+        self.merge_parts()
+
+    def load_done(self):
+        """读取checkpoint中已完成的日期"""
+        if not self.done_file.is_file():
+            return set()
+        with open(self.done_file, encoding='utf-8') as f:
+            return set(line.strip() for line in f if line.strip())
+
+    def mark_done(self, current_date):
+        """记录一个已完成的日期"""
+        with open(self.done_file, 'a', encoding='utf-8') as f:
+            f.write(current_date + '\n')
+        self.done.add(current_date)
+
+    def write_part(self, current_date, df):
+        """当天数据先写临时文件再改名，避免中断留下半个分区"""
+        part = self.part_dir / f'{current_date}.csv'
+        tmp = self.part_dir / f'{current_date}.csv.tmp'
+        df.to_csv(tmp, index=False, encoding='utf-8')
+        os.replace(tmp, part)
 
     def get_history(self, start_date, end_date):
-        current_date = start_date
-        day_count = 0
+        # 只遍历交易日，跳过周末和节假日
+        sessions = [d for d in cal.sessions(start_date, end_date) if d not in self.done]
+        if self.done:
+            print(f"从checkpoint恢复: 已完成 {len(self.done)} 天，剩余 {len(sessions)} 天")
+        # 早于这一天的交易日数据肯定已发布，拉到空结果也算完成；之后的(如今天收盘前)空结果不记，下次重跑再拉
+        last = cal.last_session()
         printed_percents = set()
-        date_all = (dt.strptime(end_date, '%Y%m%d') - dt.strptime(start_date, '%Y%m%d')).days
-        while current_date <= end_date:
+        date_all = max(len(sessions), 1)
+        for day_count, current_date in enumerate(sessions):
             try:
                 # 显示进度
                 percent = int((day_count / date_all) * 100)
                 if percent in [5, 10, 20, 40, 60, 80, 100] and percent not in printed_percents:
                     print(f"🎯 {percent}% 完成: 第 {day_count}/{date_all} 天")
                     printed_percents.add(percent)
-                df = pro.daily(trade_date=current_date)
+                # 经providers.call限流（并可命中响应缓存），不再固定sleep
+                df = providers.call('tushare', 'daily', pro.daily, trade_date=current_date)
                 if df is not None and not df.empty:
-                    # 修复：先保存当前日期的数据，再递增日期
-                    self.res.append([current_date, df])
+                    self.write_part(current_date, df)
+                    if self.db is not None:
+                        self.db.ingest_daily(df)
+                    self.mark_done(current_date)
+                elif current_date < last:
+                    self.mark_done(current_date)
             except Exception as e:
                 print(f"  {current_date}: 获取失败 - {e}")
-            
-            # 修复：日期递增应该在获取数据之后
-            current_date = date_add_one(current_date)
-            day_count += 1
-            time.sleep(1)
+
+    def merge_parts(self):
+        """按日期顺序逐个分区拼接到输出文件，内存占用与日期范围无关"""
+        parts = sorted(self.part_dir.glob('*.csv'))
+        if not parts:
+            print("没有获取到数据")
+            return
+        rows = 0
+        tmp = self.file_name + '.tmp'
+        with open(tmp, 'w', encoding='utf-8-sig', newline='') as out:
+            for i, part in enumerate(parts):
+                with open(part, encoding='utf-8', newline='') as f:
+                    header = f.readline()
+                    if i == 0:
+                        out.write(header)
+                    for line in f:
+                        out.write(line)
+                        rows += 1
+        os.replace(tmp, self.file_name)
+        print(f"数据已保存到 {self.file_name}，共 {rows} 条记录")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--start_date', '-s', type=str, default = '20240101')
     parser.add_argument('--end_date', '-e', type=str, default = str(dt.now().date()).replace('-', ''))
+    parser.add_argument('--cache', action="store_const", const=True, default = False)
+    parser.add_argument('--db', type=str, nargs='?', const=DB_FILE, default = None)
     args = parser.parse_args()
+    if args.cache:
+        providers.enable_cache()
     print(f"获取 {args.start_date} 到 {args.end_date} 的数据")
-    history = GetHistory(args.start_date, args.end_date)
\ No newline at end of file
+    history = GetHistory(args.start_date, args.end_date, MarketDB(args.db) if args.db else None)
\ No newline at end of file
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+# indicator_cache.py
+
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from response_cache import ResponseCache
+
+MAX_BYTES = 256 * 1024 ** 2
+DISK_DIR = '/opt/zack/master/indicator_cache'
+DISK_BYTES = 2 * 1024 ** 3
+
+def fingerprint(arrays):
+    """输入数组的内容指纹：每个数组的dtype、形状和全部字节一起做sha256(有硬件指令，比blake2b/md5快)"""
+    h = hashlib.sha256()
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        h.update(f'{a.dtype.str}{a.shape}'.encode())
+        h.update(a.data)
+    return h.hexdigest()
+
+def value_bytes(value):
+    return sum(v.nbytes for v in value) if isinstance(value, tuple) else value.nbytes
+
+def frozen(value):
+    """缓存里的数组设为只读：调用方误做原地修改时直接报错，而不是悄悄改坏缓存"""
+    if isinstance(value, tuple):
+        return tuple(frozen(v) for v in value)
+    if not value.flags.owndata:
+        value = value.copy()
+    value.flags.writeable = False
+    return value
+
+class DiskTier(ResponseCache):
+    """磁盘层：沿用响应缓存的存盘和按最近使用淘汰；指标结果只由输入和参数决定，永不过期"""
+
+    def ttl(self, endpoint, params):
+        return None
+
+class IndicatorCache:
+    """
+    指标结果缓存，key为 (指标名, 参数, 输入数组的指纹)
+    内存层按最近使用淘汰，结果数组的总字节数不超过max_bytes；
+    给出disk_dir时内存未命中再查磁盘层，不同进程之间也能复用
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES, disk_dir=None, disk_bytes=DISK_BYTES, version=0):
+        self.max_bytes = max_bytes
+        # 算法版本只进磁盘层的key，版本变了旧结果不再命中
+        self.version = version
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        self.disk = None if disk_dir is None else DiskTier(disk_dir, disk_bytes)
+
+    def lookup(self, name, params, arrays, compute):
+        """
+        命中时返回缓存的结果，否则调用compute()算出后存入
+        params: 参数的元组，与name一起原样作为key；arrays: 输入数组，只参与指纹
+        """
+        key = (name, params, fingerprint(arrays))
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return value
+        disk_key = {'params': params, 'fingerprint': key[2], 'version': self.version}
+        if self.disk is not None:
+            hit, value = self.disk.get('indicator', name, disk_key)
+            if hit:
+                value = frozen(value)
+                self.put(key, value, 'disk_hits')
+                return value
+        value = frozen(compute())
+        if self.disk is not None:
+            self.disk.put('indicator', name, disk_key, value)
+        self.put(key, value, 'misses')
+        return value
+
+    def put(self, key, value, stat):
+        size = value_bytes(value)
+        with self.lock:
+            self.stats[stat] += 1
+            # 比整个预算还大的结果不进内存层
+            if size > self.max_bytes:
+                return
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= value_bytes(old)
+            self.entries[key] = value
+            self.size += size
+            while self.size > self.max_bytes:
+                _, old = self.entries.popitem(last=False)
+                self.size -= value_bytes(old)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def report(self):
+        with self.lock:
+            found = self.stats['hits'] + self.stats['disk_hits']
+            total = found + self.stats['misses']
+            rate = found / total if total else 0
+            return (f"指标缓存: 命中 {found} (磁盘 {self.stats['disk_hits']}), 未命中 {self.stats['misses']}, "
+                    f"命中率 {rate:.1%}, 淘汰 {self.stats['evictions']}, "
+                    f"内存 {len(self.entries)} 项 {self.size / 1024 ** 2:.1f}MB")
@@ -0,0 +1,498 @@
+#!/usr/bin/python3
+# indicators.py
+
+import json
+import time
+import inspect
+import argparse
+import functools
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from indicator_cache import IndicatorCache, MAX_BYTES
+
+# 技术指标库，输入为Series或数组，输出为float64的numpy数组(与输入等长，前面不足窗口的位置为NaN)
+# 输入可以是一维(一只股票)，也可以是二维 日期×股票(沿第0维即时间方向计算，每列一只股票)
+# 同一类的几个指标在一次遍历里算完：MACD的两条EMA和DEA一个循环，KDJ的K、D一个循环，
+# BOLL的均值和标准差共用同一组滑动窗口
+# 各函数可传入state字典：从state里的状态接着算，算完把新状态写回，
+# 因此分几次传入和一次传入全部数据的结果逐位相同(见Stream)
+
+# 与 main.INDICATOR_PARAMS 同格式的默认参数
+PARAMS = {
+    'ma': {'n': 10},
+    'macd': {'fast': 12, 'slow': 26, 'signal': 9},
+    'boll': {'n': 20, 'k': 2},
+    'kdj': {'n': 9, 'm1': 3, 'm2': 3},
+    'rsi': {'window': 14},
+    'obv': {},
+}
+
+# 任一指标的算法改动时加1，磁盘缓存里旧算法的结果随之失效
+CACHE_VERSION = 1
+# 指标结果缓存，默认关闭；enable_cache()后不带state的调用先按 (指标, 参数, 输入内容) 查缓存
+cache = None
+computing = threading.local()
+
+def enable_cache(max_bytes=MAX_BYTES, disk_dir=None):
+    global cache
+    cache = IndicatorCache(max_bytes, disk_dir, version=CACHE_VERSION)
+    return cache
+
+def as_array(x):
+    return np.asarray(x, dtype='float64')
+
+def memoized(func):
+    """
+    不带state的调用走指标缓存：数组参数计算指纹，其余参数(含默认值)原样作为key的一部分
+    返回的数组只读；在缓存内部的嵌套调用(如boll里的rolling_mean_std)直接计算，只缓存最外层的结果
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        if cache is None or getattr(computing, 'active', False):
+            return func(*args, **kwargs)
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        if bound.arguments.get('state') is not None:
+            return func(*args, **kwargs)
+        params, arrays = [], []
+        for name, value in bound.arguments.items():
+            if value is None or np.isscalar(value):
+                params.append((name, value))
+            else:
+                arrays.append(as_array(value))
+
+        def compute():
+            computing.active = True
+            try:
+                return func(*args, **kwargs)
+            finally:
+                computing.active = False
+        return cache.lookup(func.__name__, tuple(params), arrays, compute)
+    return run
+
+def stacked(values, x):
+    """state里按时间排列的若干行，展开成 (行数,)+x.shape[1:]，一维的初值对二维输入每列一份"""
+    values = as_array(values)
+    values = values.reshape(values.shape + (1,) * (x.ndim - values.ndim))
+    return np.broadcast_to(values, (len(values),) + x.shape[1:])
+
+def ewm_step(weighted, old_wt, cur, alpha):
+    """
+    指数加权平均(adjust=False)前进一步，返回新的 (weighted, old_wt)
+    与pandas的ewm(alpha, adjust=False).mean()逐步相同：遇到NaN时保持原值，之后按间隔衰减
+    """
+    if weighted == weighted:
+        old_wt *= 1.0 - alpha
+        if cur == cur:
+            if weighted != cur:
+                weighted = (old_wt * weighted + alpha * cur) / (old_wt + alpha)
+            old_wt = 1.0
+    elif cur == cur:
+        weighted = cur
+    return weighted, old_wt
+
+def ewm_step_array(weighted, old_wt, cur, alpha):
+    """ewm_step的逐列版本，每个元素的运算与ewm_step相同"""
+    weighted, old_wt = as_array(weighted), as_array(old_wt)
+    started, observed = weighted == weighted, cur == cur
+    old_wt = np.where(started, old_wt * (1.0 - alpha), old_wt)
+    with np.errstate(invalid='ignore'):
+        mixed = (old_wt * weighted + alpha * cur) / (old_wt + alpha)
+    weighted = np.where(started & observed & (weighted != cur), mixed,
+                        np.where(~started & observed, cur, weighted))
+    return weighted, np.where(started & observed, 1.0, old_wt)
+
+def ewm_rows(x):
+    """逐行遍历用的行序列和步进函数：一维时转成Python浮点最快，二维时每行是一个数组"""
+    return (x.tolist(), ewm_step) if x.ndim == 1 else (x, ewm_step_array)
+
+def saved(*values):
+    return [np.asarray(v).tolist() for v in values]
+
+def ewm(x, alpha, state=None, key='ewm'):
+    state = {} if state is None else state
+    x = as_array(x)
+    rows, step = ewm_rows(x)
+    out = np.empty(x.shape)
+    weighted, old_wt = state.get(key, (np.nan, 1.0))
+    for i, cur in enumerate(rows):
+        weighted, old_wt = step(weighted, old_wt, cur, alpha)
+        out[i] = weighted
+    state[key] = saved(weighted, old_wt)
+    return out
+
+def ema(x, span, state=None, key='ema'):
+    return ewm(x, 2 / (span + 1), state, key)
+
+def windows(x, n, fill=np.nan, state=None, key='window'):
+    """
+    长度为n的滑动窗口，形状 x.shape+(n,)，第i行就是以i结尾的窗口
+    窗口的前n-1个值来自state里上次留下的尾部，没有时补fill
+    """
+    state = {} if state is None else state
+    x = as_array(x)
+    if len(x) == 0:
+        # 与rolling()一致返回空结果；state不变
+        return np.empty(x.shape + (n,))
+    head = stacked(state.get(key, []), x)
+    values = np.concatenate([np.full((n - 1 - len(head),) + x.shape[1:], fill), head, x])
+    state[key] = values[len(values) - (n - 1):].tolist()
+    return sliding_window_view(values, n, axis=0)
+
+def window_sum(win, center=None):
+    """
+    按窗口内位置依次相加，每行的结果只取决于这一行的值，与一共算多少行、多少列无关
+    给出center时累加的是与center之差的平方(求方差用)，不生成整个窗口大小的临时数组
+    """
+    term = (lambda j: win[..., j]) if center is None else (lambda j: (win[..., j] - center) ** 2)
+    total = term(0).copy()
+    for j in range(1, win.shape[-1]):
+        total += term(j)
+    return total
+
+def rolling_mean(x, n, state=None, key='mean'):
+    return window_sum(windows(x, n, state=state, key=key)) / n
+
+@memoized
+def rolling_mean_std(x, n, ddof=1, state=None, key='mean_std'):
+    """同一组窗口上的均值和标准差，与rolling(n).mean()/std()一致"""
+    win = windows(x, n, state=state, key=key)
+    mean = window_sum(win) / n
+    std = np.sqrt(window_sum(win, mean) / (n - ddof))
+    return mean, std
+
+def rolling_std(x, n, ddof=1, state=None, key='std'):
+    return rolling_mean_std(x, n, ddof, state, key)[1]
+
+def rolling_min(x, n, state=None, key='min'):
+    """min_periods=1：不足n行时取已有的行，跳过NaN，全是NaN时为NaN"""
+    out = np.fmin.reduce(windows(x, n, np.inf, state, key), axis=-1)
+    out[np.isinf(out)] = np.nan
+    return out
+
+def rolling_max(x, n, state=None, key='max'):
+    out = np.fmax.reduce(windows(x, n, -np.inf, state, key), axis=-1)
+    out[np.isinf(out)] = np.nan
+    return out
+
+def rolling_mean_partial(x, n, state=None, key='partial'):
+    """
+    min_periods=1的滚动均值，只对窗口内非NaN的值求平均
+    用累计和相减，state里保存最后n个累计和与累计个数
+    """
+    state = {} if state is None else state
+    x = as_array(x)
+    valid = ~np.isnan(x)
+    prev_sums, prev_counts = state.get(key, ([0.0], [0.0]))
+    prev_sums, prev_counts = stacked(prev_sums, x), stacked(prev_counts, x)
+    sums = np.concatenate([prev_sums[:-1], np.cumsum(np.concatenate([prev_sums[-1:], np.where(valid, x, 0.0)]), axis=0)])
+    counts = np.concatenate([prev_counts[:-1], np.cumsum(np.concatenate([prev_counts[-1:], valid]), axis=0)])
+    end = np.arange(len(prev_sums), len(sums))
+    start = np.maximum(end - n, 0)
+    total = sums[end] - sums[start]
+    count = counts[end] - counts[start]
+    state[key] = [sums[-n:].tolist(), counts[-n:].tolist()]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, total / count, np.nan)
+
+@memoized
+def ma(close, n, state=None):
+    return rolling_mean(close, n, state, 'ma')
+
+@memoized
+def macd(close, fast=12, slow=26, signal=9, state=None):
+    """一次遍历算出快慢EMA、DIFF、DEA，返回 (macd柱, diff, dea)"""
+    state = {} if state is None else state
+    a_fast, a_slow, a_signal = 2 / (fast + 1), 2 / (slow + 1), 2 / (signal + 1)
+    close = as_array(close)
+    rows, step = ewm_rows(close)
+    diff, dea = np.empty(close.shape), np.empty(close.shape)
+    (fast_w, fast_o), (slow_w, slow_o), (dea_w, dea_o) = state.get('macd', [(np.nan, 1.0)] * 3)
+    for i, cur in enumerate(rows):
+        fast_w, fast_o = step(fast_w, fast_o, cur, a_fast)
+        slow_w, slow_o = step(slow_w, slow_o, cur, a_slow)
+        d = fast_w - slow_w
+        dea_w, dea_o = step(dea_w, dea_o, d, a_signal)
+        diff[i], dea[i] = d, dea_w
+    state['macd'] = [saved(fast_w, fast_o), saved(slow_w, slow_o), saved(dea_w, dea_o)]
+    return 2 * (diff - dea), diff, dea
+
+@memoized
+def boll(close, n=20, k=2, state=None):
+    """返回 (上轨, 中轨, 下轨)，标准差只算一次"""
+    mid, std = rolling_mean_std(close, n, state=state, key='boll')
+    return mid + k * std, mid, mid - k * std
+
+def rsv(high, low, close, n=9, state=None):
+    low_min, high_max = rolling_min(low, n, state, 'rsv_low'), rolling_max(high, n, state, 'rsv_high')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (as_array(close) - low_min) / (high_max - low_min) * 100
+
+@memoized
+def kdj(high, low, close, n=9, m1=3, m2=3, state=None):
+    """一次遍历算出K、D，返回 (K, D, J)"""
+    state = {} if state is None else state
+    a_k, a_d = 1 / m1, 1 / m2
+    r = rsv(high, low, close, n, state)
+    rows, step = ewm_rows(r)
+    k, d = np.empty(r.shape), np.empty(r.shape)
+    (k_w, k_o), (d_w, d_o) = state.get('kdj', [(np.nan, 1.0)] * 2)
+    for i, cur in enumerate(rows):
+        k_w, k_o = step(k_w, k_o, cur, a_k)
+        d_w, d_o = step(d_w, d_o, k_w, a_d)
+        k[i], d[i] = k_w, d_w
+    state['kdj'] = [saved(k_w, k_o), saved(d_w, d_o)]
+    return k, d, 3 * k - 2 * d
+
+def diff_prev(x, state, key):
+    """与前一天的差，第一天的前一天取state里上次的最后一个值"""
+    x = as_array(x)
+    prev = stacked([state.get(key, np.nan)], x)
+    state[key] = (x[-1] if len(x) else prev[0]).tolist()
+    return np.diff(np.concatenate([prev, x]), axis=0)
+
+@memoized
+def rsi(close, window=14, state=None):
+    """涨跌幅分别做min_periods=1的滚动均值，分母加1e-6避免除零"""
+    state = {} if state is None else state
+    delta = diff_prev(close, state, 'rsi_close')
+    gain = np.where(delta < 0, 0.0, delta)
+    loss = np.where(delta > 0, 0.0, -delta)
+    rs = rolling_mean_partial(gain, window, state, 'rsi_gain') / (rolling_mean_partial(loss, window, state, 'rsi_loss') + 1e-6)
+    return 100 - 100 / (1 + rs)
+
+@memoized
+def obv(close, vol, state=None):
+    """能量潮：上涨日加成交量，下跌日减成交量，第一天为0；价格或成交量缺失的日子不变"""
+    state = {} if state is None else state
+    direction = np.nan_to_num(np.sign(diff_prev(close, state, 'obv_close')))
+    moves = direction * np.nan_to_num(as_array(vol))
+    out = np.cumsum(np.concatenate([stacked([state.get('obv', 0.0)], moves), moves]), axis=0)[1:]
+    state['obv'] = out[-1].tolist() if len(out) else state.get('obv', 0.0)
+    return out
+
+def cumsum(x):
+    """与Series.cumsum()一致：跳过NaN继续累加，NaN的位置仍为NaN"""
+    out = np.nancumsum(x, axis=0)
+    out[np.isnan(x)] = np.nan
+    return out
+
+@memoized
+def vwap(price, vol):
+    """累计成交量加权均价"""
+    vol = as_array(vol)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return cumsum(as_array(price) * vol) / cumsum(vol)
+
+class Stream:
+    """
+    按天推进的全部指标，state可存成JSON：各EMA的当前值、各滚动窗口最后n-1个值、RSI的累计和、OBV的累计值
+    update只计算传入的新行，从头一次update全部历史与分多次update的结果逐位相同
+    params 与 main.INDICATOR_PARAMS 同格式
+    """
+
+    def __init__(self, params=PARAMS, state=None):
+        self.params = params
+        self.state = {} if state is None else state
+
+    def update(self, close, high, low, vol):
+        """返回 {指标名: 各列数组的元组}，列顺序同 main.INDICATOR_COLUMNS"""
+        p, st = self.params, self.state
+        return {
+            'ma': (ma(close, p['ma']['n'], st),),
+            'macd': macd(close, p['macd']['fast'], p['macd']['slow'], p['macd']['signal'], st),
+            'boll': boll(close, p['boll']['n'], p['boll']['k'], st),
+            'kdj': kdj(high, low, close, p['kdj']['n'], p['kdj']['m1'], p['kdj']['m2'], st),
+            'rsi': (rsi(close, p['rsi']['window'], st),),
+            'obv': (obv(close, vol, st),),
+        }
+
+def compute_panel(close, high, low, vol, params=PARAMS):
+    """
+    全市场一次计算：输入为 日期×股票 的二维数组，返回 {指标名: 各列二维数组的元组}
+    收盘价为NaN的日子(上市前、停牌、退市后)视为这只股票没有这根K线：
+    每列先把有K线的行按时间顺序挪到最前面，相当于每只股票只保留自己的交易日，
+    计算后再放回原来的位置，没有K线的位置为NaN。每列的结果与用Stream单独计算这只股票逐位相同
+    """
+    close = as_array(close)
+    valid = ~np.isnan(close)
+    order = np.argsort(~valid, axis=0, kind='stable')
+
+    def gather(x):
+        return np.take_along_axis(as_array(x), order, axis=0)
+
+    def scatter(x):
+        out = np.empty_like(x)
+        np.put_along_axis(out, order, x, axis=0)
+        out[~valid] = np.nan
+        return out
+
+    res = Stream(params).update(gather(close), gather(high), gather(low), gather(vol))
+    return {name: tuple(scatter(v) for v in values) for name, values in res.items()}
+
+def reference(df, n=10):
+    """原来各处用pandas写的公式，只用于自检比对"""
+    close = df['close']
+    low_min = df['low'].rolling(9, min_periods=1).min()
+    high_max = df['high'].rolling(9, min_periods=1).max()
+    k = ((close - low_min) / (high_max - low_min) * 100).ewm(alpha=1 / 3, adjust=False).mean()
+    d = k.ewm(alpha=1 / 3, adjust=False).mean()
+    diff = close.ewm(span=12, adjust=False).mean() - close.ewm(span=26, adjust=False).mean()
+    dea = diff.ewm(span=9, adjust=False).mean()
+    mid = close.rolling(20).mean()
+    delta = close.diff()
+    gain, loss = delta.clip(lower=0), (-delta).clip(lower=0)
+    rs = gain.rolling(14, min_periods=1).mean() / (loss.rolling(14, min_periods=1).mean() + 1e-6)
+    obv = [0.0]
+    for i in range(1, len(df)):
+        step = np.sign(close.iloc[i] - close.iloc[i - 1])
+        obv.append(obv[-1] + (df['vol'].iloc[i] * step if step == step else 0))
+    return {
+        'ma': close.rolling(n).mean(),
+        'macd': 2 * (diff - dea), 'diff': diff, 'dea': dea,
+        'boll_u': mid + 2 * close.rolling(20).std(), 'boll_m': mid, 'boll_l': mid - 2 * close.rolling(20).std(),
+        'K': k, 'D': d, 'J': 3 * k - 2 * d,
+        'rsi': 100 - 100 / (1 + rs),
+        'obv': pd.Series(obv),
+        'vwap': (df['vol'] * close).cumsum() / df['vol'].cumsum(),
+        'std': close.rolling(20).std(),
+    }
+
+def compute(df, n=10):
+    upper, mid, lower = boll(df['close'])
+    m, diff, dea = macd(df['close'])
+    k, d, j = kdj(df['high'], df['low'], df['close'])
+    return {
+        'ma': ma(df['close'], n),
+        'macd': m, 'diff': diff, 'dea': dea,
+        'boll_u': upper, 'boll_m': mid, 'boll_l': lower,
+        'K': k, 'D': d, 'J': j,
+        'rsi': rsi(df['close']),
+        'obv': obv(df['close'], df['vol']),
+        'vwap': vwap(df['close'], df['vol']),
+        'std': rolling_std(df['close'], 20),
+    }
+
+def sample(rows, seed=0):
+    """随机行情：含停牌(NaN)、一字板(高低相同)和成交量为0的日子"""
+    rng = np.random.default_rng(seed)
+    close = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, rows)))
+    high = close * (1 + rng.uniform(0, 0.03, rows))
+    low = close * (1 - rng.uniform(0, 0.03, rows))
+    vol = rng.uniform(1e4, 1e6, rows)
+    flat = rng.choice(rows, rows // 50, replace=False)
+    high[flat] = low[flat] = close[flat]
+    high[:12] = low[:12] = close[:12]
+    vol[rng.choice(rows, rows // 100, replace=False)] = 0
+    close[rng.choice(rows, rows // 200, replace=False)] = np.nan
+    return pd.DataFrame({'close': close, 'high': high, 'low': low, 'vol': vol})
+
+if __name__ == "__main__":
+    # 自检：与原公式逐列比对，并比较耗时
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default = 4000)
+    parser.add_argument('--tol', type=float, default = 1e-9)
+    parser.add_argument('--stream_days', type=int, default = 250)
+    parser.add_argument('--symbols', type=int, default = 200)
+    args = parser.parse_args()
+    df = sample(args.rows)
+    start = time.perf_counter()
+    expected = reference(df)
+    ref_time = time.perf_counter() - start
+    start = time.perf_counter()
+    got = compute(df)
+    new_time = time.perf_counter() - start
+    failed = []
+    for col, values in expected.items():
+        values = values.to_numpy(dtype='float64')
+        ok = np.allclose(got[col], values, rtol=args.tol, atol=args.tol, equal_nan=True)
+        err = np.nanmax(np.abs(got[col] - values), initial=0)
+        print(f"{col:7s} {'OK' if ok else 'FAIL'}  最大误差 {err:.3g}")
+        if not ok:
+            failed.append(col)
+    print(f"{args.rows} 行: 原公式 {ref_time * 1000:.1f}ms, 指标库 {new_time * 1000:.1f}ms")
+
+    # 流式：先算前面的行，状态经JSON存取后再逐天推进，与一次算完逐位比对
+    params = PARAMS
+    cols = ['close', 'high', 'low', 'vol']
+    full = Stream(params).update(*(df[c] for c in cols))
+    head = args.rows - args.stream_days
+    stream = Stream(params)
+    parts = [stream.update(*(df[c].iloc[:head] for c in cols))]
+    start = time.perf_counter()
+    for i in range(head, args.rows):
+        stream = Stream(params, json.loads(json.dumps(stream.state)))
+        parts.append(stream.update(*(df[c].iloc[i:i + 1] for c in cols)))
+    step_time = (time.perf_counter() - start) / max(args.stream_days, 1)
+    for name, values in full.items():
+        for j, v in enumerate(values):
+            streamed = np.concatenate([part[name][j] for part in parts])
+            if not np.array_equal(streamed.view('int64'), v.view('int64')):
+                print(f"流式 {name}[{j}] 与整体计算不一致")
+                failed.append(f'stream {name}')
+    print(f"流式推进一天(含状态存取) {step_time * 1e6:.0f}us")
+
+    # 全市场：日期×股票的面板，含上市前、停牌、退市后的NaN，每列与单只股票的计算逐位比对
+    rng = np.random.default_rng(1)
+    frames = [sample(args.rows, seed) for seed in range(args.symbols)]
+    panel = {c: np.column_stack([f[c].to_numpy() for f in frames]) for c in cols}
+    for j in range(args.symbols):
+        listed, delisted = rng.integers(0, args.rows // 2), rng.integers(args.rows // 2, args.rows + 1)
+        gone = np.zeros(args.rows, dtype=bool)
+        gone[:listed] = gone[delisted:] = True
+        gone[rng.choice(args.rows, args.rows // 20, replace=False)] = True
+        for c in cols:
+            panel[c][gone, j] = np.nan
+    start = time.perf_counter()
+    got = compute_panel(*(panel[c] for c in cols))
+    panel_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for j in range(args.symbols):
+        rows = ~np.isnan(panel['close'][:, j])
+        single = Stream().update(*(panel[c][rows, j] for c in cols))
+        for name, values in single.items():
+            for k, v in enumerate(values):
+                if not np.array_equal(got[name][k][rows, j].view('int64'), v.view('int64')) \
+                        or not np.isnan(got[name][k][~rows, j]).all():
+                    failed.append(f'panel {name} {j}')
+    single_time = time.perf_counter() - start
+    print(f"面板 {args.rows} 天 × {args.symbols} 只: 整体 {panel_time:.2f}s, 逐只 {single_time:.2f}s")
+
+    # 空输入：各指标返回空数组，与pandas的rolling()一致
+    empty = compute(df.iloc[:0])
+    for col, v in empty.items():
+        if v.shape != (0,):
+            failed.append(f'empty {col}')
+    print(f"空输入 {'OK' if not any(f.startswith('empty') for f in failed) else 'FAIL'}")
+
+    # 缓存：同样的输入和参数再算一次只是查缓存，结果与不用缓存逐位相同；输入变了重新计算；磁盘层跨实例复用
+    plain = compute(df)
+    memo = enable_cache()
+    start = time.perf_counter()
+    compute(df)
+    miss_time = time.perf_counter() - start
+    calls = memo.stats['misses']
+    start = time.perf_counter()
+    cached = compute(df)
+    hit_time = time.perf_counter() - start
+    compute(df.assign(close=df['close'] * 1.01, high=df['high'] * 1.01, low=df['low'] * 1.01))
+    with tempfile.TemporaryDirectory() as tmp:
+        enable_cache(disk_dir=tmp)
+        compute(df)
+        memo_disk = enable_cache(disk_dir=tmp)
+        from_disk = compute(df)
+    for col, v in plain.items():
+        if not (np.array_equal(cached[col].view('int64'), v.view('int64'))
+                and np.array_equal(from_disk[col].view('int64'), v.view('int64'))):
+            failed.append(f'cache {col}')
+    if memo.stats['hits'] != calls or memo.stats['misses'] != 2 * calls or memo_disk.stats['disk_hits'] != calls:
+        failed.append('cache stats')
+    print(f"缓存: 未命中 {miss_time * 1000:.1f}ms, 命中 {hit_time * 1000:.2f}ms; {memo.report()}")
+    cache = None
+    if failed:
+        raise SystemExit(f"不一致: {', '.join(failed)}")
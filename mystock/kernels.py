@@ -0,0 +1,289 @@
+#!/usr/bin/python3
+# kernels.py
+
+import os
+import time
+import argparse
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# 逐行依赖前一行状态的循环(回撤、持仓、买卖状态机)
+# 装了numba时编译成机器码；没装时：能向量化的用numpy实现，状态机按原样作为Python循环运行(参数先转成list)
+# 环境变量 MARKET_NO_JIT=1 时即使装了numba也不用，便于对比和排查
+USE_JIT = numba is not None and not os.environ.get('MARKET_NO_JIT')
+
+def python(loop):
+    """状态机的Python回退：numpy数组转成list再跑循环，逐元素访问比数组快得多"""
+    def run(*args):
+        return loop(*[a.tolist() if isinstance(a, np.ndarray) else a for a in args])
+    return run
+
+def kernel(loop, fallback=None):
+    """有numba时返回编译后的loop，否则返回fallback(不给时用loop的Python回退)"""
+    if USE_JIT:
+        return numba.njit(cache=True)(loop)
+    return fallback or python(loop)
+
+def max_drawdown_loop(prices):
+    peak = prices[0]
+    max_dd = 0.0
+    for price in prices:
+        if price > peak:
+            peak = price
+        drawdown = (peak - price) / peak
+        if drawdown > max_dd:
+            max_dd = drawdown
+    return max_dd
+
+def max_drawdown_numpy(prices):
+    prices = np.asarray(prices, dtype='float64')
+    if np.isnan(prices[0]):
+        # 与逐行版本一致：起点没有价格时峰值一直无效
+        return 0.0
+    peak = np.fmax.accumulate(np.concatenate([prices[:1], prices]))[1:]
+    drawdown = (peak - prices) / peak
+    return max(0.0, np.nanmax(drawdown, initial=0.0))
+
+# 最大回撤，价格为NaN的日子跳过
+max_drawdown = kernel(max_drawdown_loop, max_drawdown_numpy)
+
+def extremes_loop(lows, highs, window):
+    """[i-window, i+window) 内的最低点/最高点(跳过NaN)，返回两个布尔数组"""
+    n = len(lows)
+    is_low = np.zeros(n, dtype=np.bool_)
+    is_high = np.zeros(n, dtype=np.bool_)
+    for i in range(window, n - window):
+        low, high = np.inf, -np.inf
+        for j in range(i - window, i + window):
+            if lows[j] < low:
+                low = lows[j]
+            if highs[j] > high:
+                high = highs[j]
+        is_low[i] = lows[i] == low
+        is_high[i] = highs[i] == high
+    return is_low, is_high
+
+def extremes_numpy(lows, highs, window):
+    lows, highs = np.asarray(lows, dtype='float64'), np.asarray(highs, dtype='float64')
+    is_low, is_high = np.zeros(len(lows), dtype=bool), np.zeros(len(highs), dtype=bool)
+    if len(lows) > 2 * window:
+        inner = slice(window, len(lows) - window)
+        is_low[inner] = lows[inner] == np.fmin.reduce(sliding_window_view(lows, 2 * window)[:len(lows) - 2 * window], axis=1)
+        is_high[inner] = highs[inner] == np.fmax.reduce(sliding_window_view(highs, 2 * window)[:len(highs) - 2 * window], axis=1)
+    return is_low, is_high
+
+# 局部低点/高点(支撑位、阻力位)
+extremes = kernel(extremes_loop, extremes_numpy)
+
+def positions_loop(signals):
+    """信号1买入持仓、-1卖出空仓、其它保持，返回每天的持仓(0/1)"""
+    out = np.zeros(len(signals))
+    current = 0.0
+    for i in range(len(signals)):
+        if signals[i] == 1:
+            current = 1.0
+        elif signals[i] == -1:
+            current = 0.0
+        out[i] = current
+    return out
+
+def positions_numpy(signals):
+    signals = np.asarray(signals, dtype='float64')
+    changed = (signals == 1) | (signals == -1)
+    last = np.maximum.accumulate(np.where(changed, np.arange(len(signals)), -1))
+    return np.where(last >= 0, signals[np.maximum(last, 0)] == 1, False).astype('float64')
+
+positions = kernel(positions_loop, positions_numpy)
+
+# mystrategy.way1~way4 的买卖状态机
+# active为False的行跳过(原来按日期过滤)；返回 (最终总资产, 交易数, 各交易的 行号/方向/总资产/现金/持股/期间最低价)
+# 方向1为买入、-1为卖出
+
+def way1_loop(active, value, k, rsi, boll_m):
+    n = len(value)
+    rows, side = np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+    total, cash, held, low = np.zeros(n), np.zeros(n), np.zeros(n), np.zeros(n)
+    count = 0
+    money_all = money = 10000.0
+    pick = 0.0
+    flag_sell = 0
+    max_v = 0.0
+    for i in range(n):
+        if not active[i]:
+            continue
+        v = value[i]
+        money_all = money + pick * v
+        if k[i] < 20 and rsi[i] < 30 and pick == 0:
+            pick += 1 * money / v
+            money = 0.0
+            rows[count], side[count], total[count], cash[count], held[count] = i, 1, money_all, money, pick
+            count += 1
+            max_v = v
+        elif k[i] > 80 and rsi[i] > 80:
+            flag_sell = 1
+        elif ((k[i] > 50 and v < boll_m[i]) or v < 0.9 * max_v) and pick > 0 and flag_sell == 1:
+            money += pick * v
+            pick = 0.0
+            rows[count], side[count], total[count], cash[count], held[count] = i, -1, money_all, money, pick
+            count += 1
+            flag_sell = 0
+        if pick > 0 and v > max_v:
+            max_v = v
+    return money_all, count, rows, side, total, cash, held, low
+
+def way2_loop(active, value, macd, diff, dea, boll_u, boll_m):
+    n = len(value)
+    rows, side = np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+    total, cash, held, low = np.zeros(n), np.zeros(n), np.zeros(n), np.zeros(n)
+    count = 0
+    money_all = money = 10000.0
+    pick = 0.0
+    max_v = 0.0
+    for i in range(n):
+        if not active[i]:
+            continue
+        v = value[i]
+        money_all = money + pick * v
+        if macd[i] > 0 and diff[i] > 0 and dea[i] > 0 and pick == 0 and v > boll_u[i]:
+            pick += 1 * money / v
+            money = 0.0
+            rows[count], side[count], total[count], cash[count], held[count] = i, 1, money_all, money, pick
+            count += 1
+            max_v = v
+        elif ((v < boll_m[i]) or (0.9 * max_v < v)) and pick > 0:
+            money += pick * v
+            pick = 0.0
+            rows[count], side[count], total[count], cash[count], held[count] = i, -1, money_all, money, pick
+            count += 1
+        if pick > 0 and v > max_v:
+            max_v = v
+    return money_all, count, rows, side, total, cash, held, low
+
+def way3_loop(active, value, k, rsi, boll_m):
+    n = len(value)
+    rows, side = np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+    total, cash, held, low = np.zeros(n), np.zeros(n), np.zeros(n), np.zeros(n)
+    count = 0
+    money_all = money = 10000.0
+    pick = 0.0
+    flag_sell = 0
+    max_v = 0.0
+    min_v = 999999.0
+    for i in range(n):
+        if not active[i]:
+            continue
+        v = value[i]
+        money_all = money + pick * v
+        if k[i] < 20 and rsi[i] < 30 and pick == 0:
+            pick += 1 * money / v
+            money -= 1 * money
+            rows[count], side[count], total[count], cash[count], held[count] = i, 1, money_all, money, pick
+            count += 1
+            max_v = v
+        elif k[i] > 80 and rsi[i] > 80:
+            flag_sell = 1
+        elif ((k[i] > 50 and v < boll_m[i]) or v < 0.9 * max_v) and pick > 0 and flag_sell == 1:
+            money += pick * v
+            pick = 0.0
+            rows[count], side[count], total[count], cash[count], held[count], low[count] = i, -1, money_all, money, pick, min_v
+            count += 1
+            flag_sell = 0
+        if pick > 0:
+            if v > max_v:
+                max_v = v
+            if v < min_v:
+                min_v = v
+        else:
+            min_v = 999999.0
+    return money_all, count, rows, side, total, cash, held, low
+
+def way4_loop(active, value, k, rsi, boll_l, boll_m):
+    n = len(value)
+    rows, side = np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+    total, cash, held, low = np.zeros(n), np.zeros(n), np.zeros(n), np.zeros(n)
+    count = 0
+    all_money = 10000.0
+    pick = 0.0
+    min_v = 999999.0
+    for i in range(n):
+        if not active[i]:
+            continue
+        v = value[i]
+        all_p = all_money / v
+        if k[i] < 20 and rsi[i] < 20 and v < boll_l[i] and all_money > 0:
+            all_money -= v * all_p
+            pick += all_p
+            rows[count], side[count], total[count], cash[count], held[count] = i, 1, all_money + pick * v, all_money, pick
+            count += 1
+        if k[i] > 80 and rsi[i] > 80 and v > boll_m[i] and pick > 0:
+            all_money += v * pick
+            pick -= pick
+            rows[count], side[count], total[count], cash[count], held[count], low[count] = i, -1, all_money, all_money, pick, min_v
+            count += 1
+            min_v = 999999.0
+        if pick > 0 and v < min_v:
+            min_v = v
+    return all_money + pick * value[len(value) - 1], count, rows, side, total, cash, held, low
+
+way1 = kernel(way1_loop)
+way2 = kernel(way2_loop)
+way3 = kernel(way3_loop)
+way4 = kernel(way4_loop)
+
+def bench_data(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    value = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, rows)))
+    k, rsi = rng.uniform(0, 100, rows), rng.uniform(0, 100, rows)
+    boll_m = value * rng.uniform(0.95, 1.05, rows)
+    return {
+        'value': value, 'k': k, 'rsi': rsi, 'boll_m': boll_m, 'boll_u': boll_m * 1.05, 'boll_l': boll_m * 0.95,
+        'macd': rng.normal(0, 1, rows), 'diff': rng.normal(0, 1, rows), 'dea': rng.normal(0, 1, rows),
+        'low': value * 0.98, 'high': value * 1.02, 'signal': rng.choice([-1, 0, 0, 0, 1], rows).astype('float64'),
+        'active': np.ones(rows, dtype=bool),
+    }
+
+def same(a, b):
+    if isinstance(a, tuple):
+        return all(same(x, y) for x, y in zip(a, b))
+    return np.array_equal(np.asarray(a, dtype='float64'), np.asarray(b, dtype='float64'), equal_nan=True)
+
+def timed(func, args, repeat):
+    func(*args)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = func(*args)
+    return out, (time.perf_counter() - start) / repeat
+
+if __name__ == "__main__":
+    # 基准：逐行Python、numpy/Python回退、numba(已安装时)三种实现的单只股票耗时，并核对结果一致
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default = 4000)
+    parser.add_argument('--repeat', type=int, default = 20)
+    args = parser.parse_args()
+    d = bench_data(args.rows)
+    cases = {
+        'max_drawdown': (max_drawdown_loop, max_drawdown_numpy, (d['value'],)),
+        'extremes': (extremes_loop, extremes_numpy, (d['low'], d['high'], 20)),
+        'positions': (positions_loop, positions_numpy, (d['signal'],)),
+        'way1': (way1_loop, python(way1_loop), (d['active'], d['value'], d['k'], d['rsi'], d['boll_m'])),
+        'way2': (way2_loop, python(way2_loop),
+                 (d['active'], d['value'], d['macd'], d['diff'], d['dea'], d['boll_u'], d['boll_m'])),
+        'way3': (way3_loop, python(way3_loop), (d['active'], d['value'], d['k'], d['rsi'], d['boll_m'])),
+        'way4': (way4_loop, python(way4_loop), (d['active'], d['value'], d['k'], d['rsi'], d['boll_l'], d['boll_m'])),
+    }
+    print(f"{args.rows} 行, numba {'未安装' if numba is None else numba.__version__}")
+    for name, (loop, fallback, call_args) in cases.items():
+        expected, loop_time = timed(loop, call_args, 1)
+        got, fallback_time = timed(fallback, call_args, args.repeat)
+        line = f"{name:13s} 逐行 {loop_time * 1e6:9.0f}us  回退 {fallback_time * 1e6:9.0f}us"
+        results = [got]
+        if numba is not None:
+            got, jit_time = timed(numba.njit(cache=True)(loop), call_args, args.repeat)
+            line += f"  numba {jit_time * 1e6:7.1f}us"
+            results.append(got)
+        print(line + ("" if all(same(expected, r) for r in results) else "  结果不一致"))
@@ -4,12 +4,13 @@ import pandas as pd
 import akshare as ak
 import tushare as ts
 import matplotlib.pyplot as plt
-import sys, os
+import sys
 import numpy as np
-from pathlib import Path
 from mplfinance.original_flavor import candlestick2_ohlc
 from matplotlib.ticker import FormatStrFormatter
 import argparse
+import indicators
+import indicator_cache
 from p_name import p_list
 from my_name import buy_list
 from my_name import imp_list
@@ -17,7 +18,13 @@ from my_name import way1_list
 from my_name import way2_list
 from strategy import signal
 from mystrategy import mystrategy
-import requests
+from fetch_pool import fetch_all, FETCH_WORKERS
+from trade_cal import TradeCalendar
+from transport import Transport
+from providers import ProviderRouter
+import providers
+from store import open_store
+from manifest import range_checksums
 import time
 from datetime import datetime as dt, date
 from typing import List
@@ -35,6 +42,45 @@ BOLL_N = 20
 BOLL_K = 2
 RSI_WINDOW = 14
 
+# 派生列的来源：指标名、参数、算法版本，写入存储时记录在清单里
+# 改了参数或算法(同时把版本加1)后，python main.py --rebuild 只在本地重算受影响的列
+INDICATOR_VERSIONS = {'ma': 1, 'macd': 1, 'boll': 1, 'kdj': 1, 'rsi': 1, 'obv': 2}
+INDICATOR_PARAMS = {
+    'ma': {'n': 10},
+    'macd': {'fast': MACD_FAST, 'slow': MACD_SLOW, 'signal': MACD_SIGNAL},
+    'boll': {'n': BOLL_N, 'k': BOLL_K},
+    'kdj': {'n': KDJ_N, 'm1': KDJ_M1, 'm2': KDJ_M2},
+    'rsi': {'window': RSI_WINDOW},
+    'obv': {},
+}
+INDICATOR_COLUMNS = {
+    'ma': ['10-day'],
+    'macd': ['macd', 'diff', 'dea'],
+    'boll': ['boll_u', 'boll_m', 'boll_l'],
+    'kdj': ['K', 'D', 'J'],
+    'rsi': ['rsi'],
+    'obv': ['obv'],
+}
+LINEAGE = {col: {'indicator': name, 'params': INDICATOR_PARAMS[name], 'version': INDICATOR_VERSIONS[name]}
+           for name, cols in INDICATOR_COLUMNS.items() for col in cols}
+
+# 实时行情每次请求的股票数
+QUOTE_BATCH = 50
+# res中保存的原始高开低，用于本地重算指标
+OHLC_COLS = ['open', 'high', 'low']
+RES_COLUMNS = ['date', 'value', '10-day', 'vol', 'vor', 'tor', 'macd', 'diff', 'dea', 'boll_u', 'boll_m', 'boll_l',
+               'K', 'D', 'J', 'rsi', 'obv'] + OHLC_COLS
+# 校验时向数据源抽查最近多少根K线，以及比对的价格列和相对误差
+PROBE_BARS = 5
+PROBE_COLS = ['close', 'open', 'high', 'low']
+PROBE_TOL = 1e-6
+# 修补缺口时，相隔不超过这么多个交易日的缺口合并成一次请求
+GAP_MERGE = 5
+# 全市场重算指标时每批对齐成一个矩阵的股票数，限制内存占用
+PANEL_CHUNK = 500
+# 截面批量更新时，最后日期落后最新股票超过这么多个交易日的股票不参与决定起始日期，改为逐只更新
+BULK_STALE_SESSIONS = 20
+
 headers = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
@@ -43,28 +89,28 @@ headers = {
     'Connection': 'keep-alive',
     'Upgrade-Insecure-Requests': '1',
 }
-# 禁用 requests 的代理
-session = requests.Session()
-session.trust_env = False  # 忽略系统代理
-
-ak.session = session
-
-# 临时替换 requests 的默认行为
-original_get = requests.get
-requests.get = session.get
+# akshare和tushare共用的传输层：连接池、超时、429/5xx退避重试，不走系统代理
+transport = Transport(pool_size=FETCH_WORKERS * 2)
+transport.install()
 # print(f"akshare版本: {ak.__version__}")
 # print(dir(ak))
 # ak.set_config(headers=headers)
 
 ts.set_token('5c940b85806741e9a4aedd3495a9fd43c11a0542d4b3ad641c1ef949')
 pro = ts.pro_api()
+cal = TradeCalendar(pro=pro)
+router = ProviderRouter(['akshare', 'tushare'])
+store = open_store()
+
+def is_stale(last_date):
+    """本地最后日期早于最近一个已收盘的交易日时才需要更新"""
+    return last_date.replace('-', '') < cal.last_session()
 
 def get_all_stocks_today() -> List[str]:
     try:
         today_dt = dt.now()  # dt是datetime的别名
         today_str = today_dt.strftime('%Y%m%d')
-        today_int = int(today_str)
-        df = pro.daily(trade_date=today_int)
+        df = get_daily_by_date(today_str)
         if df is None or df.empty:
             print(f"今天({today_str})没有交易数据")
             return []
@@ -83,50 +129,184 @@ def get_all_stocks_today() -> List[str]:
         print(f"获取当天股票数据失败: {e}")
         return []
 
-def get_A_data_from_python(p_SN):
-    data = pd.DataFrame(columns=['date', 'now', 'close', 'high', 'low', 'open', 'vol', 'vor', 'tor'])
+def get_daily_by_date(trade_date):
+    """一次 pro.daily 调用拉取某个交易日的全市场日线"""
+    return providers.call('tushare', 'daily', pro.daily, trade_date=trade_date)
+
+def daily_to_data(df):
+    """
+    把 pro.daily 的截面日线转换成 get_A_data_from_python 的列格式，附带sn列
+    成交额由千元换算成元与akshare一致，pro.daily没有换手率，tor置空
+    """
+    df = df.sort_values(['ts_code', 'trade_date'])
+    data = pd.DataFrame({
+        'sn': df['ts_code'].str.split('.').str[0],
+        'date': pd.to_datetime(df['trade_date'].astype(str), format='%Y%m%d').dt.strftime('%Y-%m-%d'),
+        'now': df['close'],
+        'close': df['close'],
+        'high': df['high'],
+        'low': df['low'],
+        'open': df['open'],
+        'vol': df['vol'],
+        'vor': df['amount'] * 1000,
+        'tor': np.nan,
+    })
+    return data.reset_index(drop=True)
+
+def get_realtime_quotes(sns):
+    """
+    批量拉取实时行情，每QUOTE_BATCH只一次请求
+
+    返回:
+    以sn为索引的DataFrame，列为 last(昨收) high open close(现价)，均为数值
+    """
+    parts = []
+    for i in range(0, len(sns), QUOTE_BATCH):
+        parts.append(providers.call('sina', 'get_realtime_quotes', ts.get_realtime_quotes,
+                                    symbols=list(sns[i:i + QUOTE_BATCH])))
+    df = pd.concat(parts, ignore_index=True)
+    quotes = pd.DataFrame({
+        'sn': df['code'],
+        'last': pd.to_numeric(df['pre_close'], errors='coerce'),
+        'high': pd.to_numeric(df['high'], errors='coerce'),
+        'open': pd.to_numeric(df['open'], errors='coerce'),
+        'close': pd.to_numeric(df['price'], errors='coerce'),
+    })
+    return quotes.set_index('sn')
+
+def bulk_update(start_date=None, end_date=None):
+    """
+    截面批量更新：每个缺失的交易日（按交易日历）调用一次 pro.daily(trade_date=...)，
+    按 ts_code 拆分后追加到各股票的本地数据并重算指标
+
+    参数:
+    start_date: 开始日期YYYYMMDD，默认取近期更新过的股票中最早的最后日期的下一天，
+                落后最新日期超过BULK_STALE_SESSIONS个交易日的股票(停牌、退市等)不参与决定起始日期；
+                最后日期接不上起始日期的股票都不走截面，改为逐只补
+    end_date: 结束日期YYYYMMDD，默认最近一个已收盘的交易日
+    """
+    last_dates = store.last_dates()
+    if not last_dates:
+        print(f"{store.data_dir} 下没有可更新的数据")
+        return
+    end_date = end_date or cal.last_session()
+    if start_date is None:
+        newest = max(last_dates.values()).replace('-', '')
+        recent = cal.sessions((pd.to_datetime(newest) - pd.Timedelta(days=2 * BULK_STALE_SESSIONS + 15)).strftime('%Y%m%d'),
+                              newest)
+        cutoff = recent[-BULK_STALE_SESSIONS] if len(recent) >= BULK_STALE_SESSIONS else recent[0]
+        first = min(d for d in last_dates.values() if d.replace('-', '') >= cutoff)
+        start_date = (pd.to_datetime(first) + pd.Timedelta(days=1)).strftime('%Y%m%d')
+    # 只有最后日期不早于起始日前一个交易日的股票，截面数据才能无缝接上；
+    # 其余的(停牌、退市或--up_start给得太晚)直接追加会留下缺口，改为逐只拉增量
+    start = pd.to_datetime(start_date)
+    prev = cal.sessions((start - pd.Timedelta(days=30)).strftime('%Y%m%d'),
+                        (start - pd.Timedelta(days=1)).strftime('%Y%m%d'))
+    prev = prev[-1] if prev else '00000000'
+    behind = sorted(sn for sn, d in last_dates.items() if d.replace('-', '') < prev)
+
+    new_rows = {}
+    for day_str in cal.sessions(start_date, end_date):
+        try:
+            df = get_daily_by_date(day_str)
+        except Exception as e:
+            # 跳过这一天会让之后追加的行前面缺一天，到此为止，下次从这一天接着更新
+            print(f"  {day_str}: 获取失败 - {e}，截面更新到前一个交易日为止")
+            break
+        if df is None or df.empty:
+            continue
+        for sn, rows in daily_to_data(df).groupby('sn'):
+            if sn in last_dates and sn not in behind and rows['date'].iloc[-1] > last_dates[sn]:
+                new_rows.setdefault(sn, []).append(rows.drop(columns='sn'))
+        print(f"{day_str}: {len(df)} 条")
+
+    failed = []
+    for sn, parts in new_rows.items():
+        try:
+            stock(sn, '').Append_Data(pd.concat(parts, ignore_index=True))
+        except Exception as e:
+            print(f"  {sn}: 更新失败 - {e}")
+            failed.append(sn)
+    print(f"截面更新完成: {len(new_rows)}/{len(last_dates)} 只股票有新数据, 失败 {len(failed)} 只")
+    if behind:
+        print(f"另有 {len(behind)} 只股票的最后日期早于 {prev}，逐只更新")
+        for sn in behind:
+            try:
+                stock(sn, '').Get_Data(load=False)
+            except Exception as e:
+                print(f"  {sn}: 更新失败 - {e}")
+                failed.append(sn)
+    if failed:
+        print("失败:", ','.join(failed))
+
+DATA_COLUMNS = ['date', 'now', 'close', 'high', 'low', 'open', 'vol', 'vor', 'tor']
+
+def akshare_daily(p_SN, start_date, end_date):
+    """akshare日线，转换成统一的列格式"""
+    data = pd.DataFrame(columns=DATA_COLUMNS)
+    dt = providers.call('akshare', 'stock_zh_a_hist', ak.stock_zh_a_hist,
+                        symbol=p_SN, start_date=start_date, end_date=end_date)
+    if dt.empty:
+        return data
+    data['date'] = pd.to_datetime(dt['日期'])  # 立即转换为datetime
+    data['now'] = dt['收盘']
+    data['close'] = dt['收盘']
+    data['high'] = dt['最高']
+    data['low'] = dt['最低']
+    data['open'] = dt['开盘']
+    data['vol'] = dt['成交量']
+    data['vor'] = dt['成交额']
+    data['tor'] = dt['换手率']
+    return data
+
+def tushare_daily(p_SN, start_date, end_date):
+    """tushare日线，转换成统一的列格式"""
+    data = pd.DataFrame(columns=DATA_COLUMNS)
+    if p_SN.startswith('6'):
+        ts_code = p_SN+'.SH'
+    elif p_SN.startswith('9'):
+        ts_code = p_SN+'.BJ'
+    else:
+        ts_code = p_SN+'.SZ'
+    dt = providers.call('tushare', 'daily', pro.daily, ts_code=ts_code, start_date=start_date, end_date=end_date)
+    if dt is None or dt.empty:
+        return data
+    dt = dt.sort_values(by='trade_date', ascending=True)
+    dt = dt.reset_index(drop=True)
+
+    # 直接创建datetime格式的日期
+    data['date'] = pd.to_datetime(dt['trade_date'].astype(str), format='%Y%m%d')
+    data['now'] = dt['close']
+    data['close'] = dt['close']
+    data['high'] = dt['high']
+    data['low'] = dt['low']
+    data['open'] = dt['open']
+    data['vol'] = dt['vol']
+    # 成交额由千元换算成元与akshare一致；pro.daily没有换手率(pct_chg是涨跌幅)，tor置空
+    data['vor'] = dt['amount'] * 1000
+    data['tor'] = np.nan
+    return data
+
+def get_A_data_from_python(p_SN, start_date='20100101', end_date=None):
+    """
+    拉取单只股票[start_date, end_date]区间的日线
+    默认先akshare后tushare，熔断打开或者滚动耗时/错误率变差时直接改走另一个数据源
+
+    参数:
+    start_date: 开始日期YYYYMMDD，增量更新时传本地最后日期的下一天
+    end_date: 结束日期YYYYMMDD，默认今天
+    """
+    end_date = end_date or date.today().strftime('%Y%m%d')
     try:
-        dt = ak.stock_zh_a_hist(symbol=p_SN)
-        data['date'] = pd.to_datetime(dt['日期'])  # 立即转换为datetime
-        data['now'] = dt['收盘']
-        data['close'] = dt['收盘']
-        data['high'] = dt['最高']
-        data['low'] = dt['最低']
-        data['open'] = dt['开盘']
-        data['vol'] = dt['成交量']
-        data['vor'] = dt['成交额']
-        data['tor'] = dt['换手率']
-        
-        # 筛选2010年以后的数据
-        data = data[data['date'] >= '2010-01-01']
-        
-    except Exception as e:
-        if p_SN.startswith('6'):
-            dt = pro.daily(ts_code=p_SN+'.SH')
-        elif p_SN.startswith('9'):
-            dt = pro.daily(ts_code=p_SN+'.BJ')
-        else:
-            dt = pro.daily(ts_code=p_SN+'.SZ')
-        dt = dt.sort_values(by='trade_date', ascending=True)
-        dt = dt.reset_index(drop=True)
-        
-        # 直接创建datetime格式的日期
-        data['date'] = pd.to_datetime(dt['trade_date'].astype(str), format='%Y%m%d')
-        data['now'] = dt['close']
-        data['close'] = dt['close']
-        data['high'] = dt['high']
-        data['low'] = dt['low']
-        data['open'] = dt['open']
-        data['vol'] = dt['vol']
-        data['vor'] = dt['amount']
-        data['tor'] = dt['pct_chg']
-        
-        # 筛选2010年以后的数据
-        data = data[data['date'] >= '2010-01-01']
-        
-        time.sleep(1)
-    except:
+        data = router.run({
+            'akshare': lambda: akshare_daily(p_SN, start_date, end_date),
+            'tushare': lambda: tushare_daily(p_SN, start_date, end_date),
+        })
+    except Exception:
         print(f"获取{p_SN}数据失败")
+        raise
+    # 筛选区间内的数据
+    data = data[data['date'] >= pd.to_datetime(start_date)].reset_index(drop=True)
     if not data.empty and 'date' in data.columns:
         data['date'] = pd.to_datetime(data['date']).dt.strftime('%Y-%m-%d')
     return data
@@ -138,91 +318,343 @@ class stock:
         pd.set_option('display.width', 180)
         self.p_SN = p_SN
         self.p_name = p_name
+        self.res = None
+        self.data = None
+        self.delta = None
+        # 流式指标状态(indicators.Stream)，对应self.res的最后一行
+        self.stream = None
         pd.set_option('display.max_columns', None)
 
-    def Get_Data(self, flag=False):
-        file_name = f'/opt/zack/master/data/{self.p_SN}.csv'
-        if Path(file_name).is_file():
-            self.res = pd.read_csv(file_name, encoding="utf-8-sig")
-            if (self.res['date'].iloc[-1] != str(date.today())) and not flag:
-                print(self.res['date'].iloc[-1] , str(date.today()), file_name)
-                self.data = get_A_data_from_python(self.p_SN)
-                update_size = self.res.index.size
-                # macd, diff = self.Get_MACD()
-                # boll_u, boll_m, boll_l = self.Get_BOLL()
-                # K, D, J = self.Get_KDJ()
-                # rsi = self.Get_Rsi()
-                print(self.res.index.size, len(self.data))
-                for i in range(self.res.index.size, len(self.data)):
-                    self.res.loc[i,'date'] = self.data.date[i]
-                    self.res.loc[i,'value'] = self.data.close[i]
-                    # self.res.loc[i,'5--day'] = self.data.close[i-5:].rolling(5).mean()[i]
-                    self.res.loc[i,'10-day'] = self.data.close[i-10:].rolling(10).mean()[i]
-                    self.res.loc[i,'vol'] = self.data.vol[i]
-                    self.res.loc[i,'vor'] = self.data.vor[i]
-                    self.res.loc[i,'tor'] = self.data.tor[i]
-                    # self.res.loc[i,'macd'] = macd[i]
-                    # self.res.loc[i,'diff'] = diff[i]
-                    # self.res.loc[i,'boll_u'] = boll_u[i]
-                    # self.res.loc[i,'boll_m'] = boll_m[i]
-                    # self.res.loc[i,'boll_l'] = boll_l[i]
-                    # self.res.loc[i,'K'] = K[i]
-                    # self.res.loc[i,'D'] = D[i]
-                    # self.res.loc[i,'J'] = J[i]
-                    # self.res.loc[i,'rsi'] = rsi[i]
-                self.res['macd'], self.res['diff'], self.res['dea'] = self.Get_MACD()
-                self.res['boll_u'], self.res['boll_m'], self.res['boll_l'] = self.Get_BOLL()
-                self.res['K'], self.res['D'], self.res['J'] = self.Get_KDJ()
-                self.res['rsi'] = self.Get_Rsi()
-                self.res['obv'] = self.Get_OBV()
-                self.res.to_csv(file_name, index=False, encoding='utf-8-sig')
-                if update_size != len(self.data):
-                    print(self.p_SN, self.p_name ,' update csv')
+    def Need_Update(self, flag=False):
+        """判断是否需要拉取行情，过期时读入本地数据"""
+        if store.exists(self.p_SN):
+            # 先查清单里的最后日期，不过期就不用读数据文件
+            if flag or not is_stale(store.last_date(self.p_SN)):
+                return False
+            self.res = store.read(self.p_SN)
+            return True
+        return True
+
+    def Get_Data(self, flag=False, load=True):
+        """
+        参数:
+        load: 数据没过期时是否也读入self.res，只看最新一行时传False
+        """
+        if store.exists(self.p_SN):
+            last_date = store.last_date(self.p_SN)
+            if is_stale(last_date) and not flag:
+                if self.res is None:
+                    self.res = store.read(self.p_SN)
+                print(last_date , cal.last_session(), store.path(self.p_SN))
+                if self.data is None and self.delta is None:
+                    self.Fetch_Data()
+                if self.delta is not None:
+                    # 本地数据带高开低：只为新行计算指标并追加
+                    if self.Append_Res(self.delta):
+                        print(self.p_SN, self.p_name ,' update data')
+                else:
+                    # 老格式文件：全量重建一次，补齐高开低
+                    if self.Build_Res():
+                        store.write(self.p_SN, self.res, LINEAGE, self.State())
+                        print(self.p_SN, self.p_name ,' update data')
+            elif load and self.res is None:
+                self.res = store.read(self.p_SN)
+        else:
+            if self.data is None:
+                self.Fetch_Data()
+            if not self.Build_Res():
+                print(self.p_SN, self.p_name, ' no data')
+                return
+            store.write(self.p_SN, self.res, LINEAGE, self.State())
+
+    def Fetch_Data(self):
+        """
+        拉取行情
+        本地数据带高开低时只拉最后日期之后的增量到self.delta，否则拉全量到self.data
+        """
+        if self.res is not None and set(OHLC_COLS).issubset(self.res.columns):
+            start = (pd.to_datetime(self.res['date'].iloc[-1]) + pd.Timedelta(days=1)).strftime('%Y%m%d')
+            self.delta = get_A_data_from_python(self.p_SN, start_date=start)
         else:
             self.data = get_A_data_from_python(self.p_SN)
-            self.res = pd.DataFrame()
-            self.res['date'] = self.data['date']
-            self.res['value'] = self.data['close']
-            # self.res['5--day'] = self.data.close.rolling(5).mean()
-            self.res['10-day'] = self.data.close.rolling(10).mean()
-            self.res['vol'] = self.data.vol
-            self.res['vor'] = self.data.vor
-            self.res['tor'] = self.data.tor
-            self.res['macd'], self.res['diff'], self.res['dea'] = self.Get_MACD()
-            self.res['boll_u'], self.res['boll_m'], self.res['boll_l'] = self.Get_BOLL()
-            self.res['K'], self.res['D'], self.res['J'] = self.Get_KDJ()
-            self.res['rsi'] = self.Get_Rsi()
-            self.res['obv'] = self.Get_OBV()
-            self.res.to_csv(file_name, index=False, encoding='utf-8-sig')
+
+    def Build_Res(self):
+        """
+        由self.data生成res（含全部指标列），同时得到算到最后一行的流式指标状态self.stream
+        没拉到行情时不计算，返回False，调用方不写入存储
+        """
+        if self.data is None or self.data.empty:
+            return False
+        self.stream = indicators.Stream(INDICATOR_PARAMS)
+        self.res = self.Stream_Rows(self.data, self.stream)
+        return True
+
+    def Stream_Rows(self, data, stream):
+        """行情data用stream接着算指标，生成对应的res行"""
+        res = pd.DataFrame()
+        res['date'] = data['date']
+        res['value'] = data['close']
+        # res['5--day'] = data.close.rolling(5).mean()
+        res['vol'] = data.vol
+        res['vor'] = data.vor
+        res['tor'] = data.tor
+        for col in OHLC_COLS:
+            res[col] = data[col]
+        for name, values in stream.update(data['close'], data['high'], data['low'], data['vol']).items():
+            for col, v in zip(INDICATOR_COLUMNS[name], values):
+                res[col] = v
+        return res[RES_COLUMNS]
+
+    def State(self):
+        """与self.res最后一行对应的流式指标状态，随数据一起存入清单"""
+        return {'date': self.res['date'].iloc[-1], 'stream': self.stream.state}
+
+    def Restore_Stream(self):
+        """
+        取出存储的流式指标状态；没有或与本地最后日期对不上时(老数据、整体重写过)，
+        用本地全部行情重放一次得到状态
+        """
+        state = store.state(self.p_SN)
+        if state is not None and state['date'] == self.res['date'].iloc[-1]:
+            self.stream = indicators.Stream(INDICATOR_PARAMS, state['stream'])
+            return
+        self.stream = indicators.Stream(INDICATOR_PARAMS)
+        data = self.Res_To_Data()
+        self.stream.update(data['close'], data['high'], data['low'], data['vol'])
+
+    def Compute(self, names):
+        """由self.data计算指定的指标，返回 {列名: Series}；参数一律取INDICATOR_PARAMS，与Build_Res和LINEAGE一致"""
+        p = INDICATOR_PARAMS
+        funcs = {
+            'ma': lambda: (self.Series(indicators.ma(self.data['close'], p['ma']['n'])),),
+            'macd': lambda: self.Get_MACD(p['macd']['fast'], p['macd']['slow'], p['macd']['signal']),
+            'boll': lambda: self.Get_BOLL(p['boll']['n'], p['boll']['k']),
+            'kdj': lambda: self.Get_KDJ(p['kdj']['n'], p['kdj']['m1'], p['kdj']['m2']),
+            'rsi': lambda: (self.Get_Rsi(p['rsi']['window']),),
+            'obv': lambda: (self.Get_OBV(),),
+        }
+        cols = {}
+        for name in names:
+            cols.update(zip(INDICATOR_COLUMNS[name], funcs[name]()))
+        return cols
+
+    def Stale_Indicators(self):
+        """清单里记录的来源与当前参数/版本不一致的指标"""
+        stored = store.lineage(self.p_SN)
+        return [name for name, cols in INDICATOR_COLUMNS.items()
+                if any(stored.get(col) != LINEAGE[col] for col in cols)]
+
+    def Rebuild(self, names=None):
+        """
+        用本地存储的行情重算过期(或指定)的指标列并整体写回，不联网
+        返回重算的指标；老格式文件没有高开低无法本地重算，返回None
+        """
+        if self.res is None:
+            self.res = store.read(self.p_SN)
+        if not set(OHLC_COLS).issubset(self.res.columns):
+            return None
+        names = self.Stale_Indicators() if names is None else names
+        if not names:
+            return []
+        self.data = self.Res_To_Data()
+        for col, values in self.Compute(names).items():
+            self.res[col] = values
+        self.data = None
+        # 只重算了部分列，流式状态作废，下次追加时重放
+        store.write(self.p_SN, self.res, LINEAGE)
+        return names
+
+    def Append_Res(self, new_data):
+        """
+        增量更新：只为new_data中晚于本地最后日期的行计算指标，追加到self.res，并只把这些行写入存储
+        指标从存储的流式状态接着算，耗时只与新行数有关，结果与全量重算逐位相同
+        返回是否有新行
+        """
+        new_data = new_data[new_data['date'] > self.res['date'].iloc[-1]]
+        if new_data.empty:
+            return False
+        # 指标参数变过时先按新参数重算历史，否则新旧参数算出的行会混在一起
+        if self.Stale_Indicators():
+            self.Rebuild()
+        self.Restore_Stream()
+        history = self.res
+        rows = self.Stream_Rows(new_data, self.stream).reindex(columns=history.columns)
+        rows.index = range(len(history), len(history) + len(rows))
+        self.res = pd.concat([history, rows])
+        store.append(self.p_SN, rows, self.State())
+        return True
+
+    def Res_To_Data(self):
+        """由本地res还原出get_A_data_from_python格式的行情"""
+        return pd.DataFrame({
+            'date': self.res['date'],
+            'now': self.res['value'],
+            'close': self.res['value'],
+            'high': self.res['high'],
+            'low': self.res['low'],
+            'open': self.res['open'],
+            'vol': self.res['vol'],
+            'vor': self.res['vor'],
+            'tor': self.res['tor'],
+        })
+
+    def Append_Data(self, new_data):
+        """把新的日线追加到本地数据，只计算和写入新行"""
+        if self.res is None:
+            self.res = store.read(self.p_SN)
+        if not set(OHLC_COLS).issubset(self.res.columns):
+            # 老格式文件没有高开低，无法本地重算KDJ，走一次全量更新补齐
+            self.Get_Data()
+            return
+        if self.Append_Res(new_data):
+            print(self.p_SN, self.p_name ,' update data')
 
     def Read_import(self):
         # data = get_A_data_from_python(self.p_SN)
         # n_val = data.loc[data.index == data.index.size-1].copy()
-        data = ts.get_realtime_quotes(self.p_SN)
-        n_val = pd.DataFrame(columns=['last', 'high', 'open', 'close'])
-        n_val['last'] = data['pre_close']
-        n_val['high'] = data['high']
-        n_val['open'] = data['open']
-        n_val['close'] = data['price']
-        for col in n_val:
-            if col in n_val.columns:
-                n_val[col] = pd.to_numeric(n_val[col], errors='coerce')
-        return n_val
-
-    def Check_Data(self):
-        file_name = f'/opt/zack/master/data/{self.p_SN}.csv'
-        if Path(file_name).is_file():
+        return get_realtime_quotes([self.p_SN]).reset_index(drop=True)
+
+    def Verify(self, probe_bars=PROBE_BARS, repair=True):
+        """
+        校验本地数据，不需要交互
+        1. 按月重算分段校验和，与清单里写入时记录的比对，找出被改坏的月份
+        2. 向数据源抽查最近probe_bars根K线，价格不一致或缺行的月份同样判为有问题
+        3. repair=True时只重新拉取有问题的月份，拼回本地数据后重算指标写回
+
+        返回:
+        dict: sn, corrupt(校验和不一致的月份), probe(抽查不一致的日期), repaired(已修复的月份), error
+        """
+        report = {'sn': self.p_SN, 'corrupt': [], 'probe': [], 'repaired': [], 'error': None}
+        self.res = store.read(self.p_SN)
+        if self.res.empty:
+            return report
+        stored = store.manifest.ranges(self.p_SN)
+        actual = range_checksums(self.res)
+        report['corrupt'] = sorted(p for p in stored if stored[p] != actual.get(p))
+
+        dates = self.res['date'].iloc[-probe_bars:]
+        probe = get_A_data_from_python(self.p_SN, start_date=dates.iloc[0].replace('-', ''),
+                                       end_date=dates.iloc[-1].replace('-', ''))
+        local = self.Res_To_Data().set_index('date') if set(OHLC_COLS).issubset(self.res.columns) \
+            else self.res.set_index('date').rename(columns={'value': 'close'})
+        for _, row in probe.iterrows():
+            cols = [c for c in PROBE_COLS if c in local.columns]
+            if row['date'] not in local.index or not np.allclose(
+                    local.loc[row['date'], cols].to_numpy(dtype=float), row[cols].to_numpy(dtype=float),
+                    rtol=PROBE_TOL, equal_nan=True):
+                report['probe'].append(row['date'])
+
+        bad = sorted(set(report['corrupt']) | {d[:7] for d in report['probe']})
+        if bad and repair:
+            self.Repair_Periods(bad)
+            report['repaired'] = bad
+        elif set(actual) - set(stored) and not report['corrupt']:
+            # 清单是在分段校验和加入之前写的，没有问题时补上基准；流式状态一并带上，否则下次追加要重放全部历史
+            state = None
+            if set(OHLC_COLS).issubset(self.res.columns):
+                self.Restore_Stream()
+                state = self.State()
+            store.manifest.replace(self.p_SN, self.res, state=state)
+        return report
+
+    def Repair_Periods(self, periods):
+        """重新拉取指定月份(YYYY-MM)，连续的月份合并成一次请求，拼回本地数据后重算全部指标"""
+        if not set(OHLC_COLS).issubset(self.res.columns):
+            # 老格式文件没有高开低，无法局部拼接，直接全量更新
+            self.data = get_A_data_from_python(self.p_SN)
+        else:
+            months = pd.PeriodIndex(periods, freq='M')
+            runs = []
+            for m in months:
+                if runs and m == runs[-1][1] + 1:
+                    runs[-1][1] = m
+                else:
+                    runs.append([m, m])
+            data = self.Res_To_Data()
+            month = pd.PeriodIndex(data['date'].str[:7], freq='M')
+            keep = np.ones(len(data), dtype=bool)
+            fetched = []
+            for first, last in runs:
+                keep &= (month < first) | (month > last)
+                fetched.append(get_A_data_from_python(self.p_SN, start_date=first.start_time.strftime('%Y%m%d'),
+                                                      end_date=last.end_time.strftime('%Y%m%d')))
+            self.data = pd.concat([data[keep]] + fetched, ignore_index=True).sort_values('date').reset_index(drop=True)
+        if self.Build_Res():
+            store.write(self.p_SN, self.res, LINEAGE, self.State())
+
+    def Scan_Gaps(self):
+        """
+        对照交易日历扫描本地数据
+        missing: 缺失的交易日(不含已确认数据源也没有的)
+        duplicate: 重复的日期
+        schema: 列缺失/多余/不是数值
+        tushare: 老版本tushare回退写入的行(成交额单位是千元，tor里存的是涨跌幅)
+        """
+        report = {'sn': self.p_SN, 'missing': [], 'duplicate': [], 'schema': [], 'tushare': [], 'repaired': 0}
+        self.res = store.read(self.p_SN)
+        if self.res.empty:
+            return report
+        dates = self.res['date']
+        report['duplicate'] = sorted(dates[dates.duplicated()].unique())
+        sessions = cal.sessions(dates.min().replace('-', ''), dates.max().replace('-', ''))
+        sessions = {f'{d[:4]}-{d[4:6]}-{d[6:]}' for d in sessions}
+        report['missing'] = sorted(sessions - set(dates) - store.manifest.absent(self.p_SN))
+        report['schema'] += [f'缺少列 {c}' for c in RES_COLUMNS if c not in self.res.columns]
+        report['schema'] += [f'多余列 {c}' for c in self.res.columns if c not in RES_COLUMNS]
+        report['schema'] += [f'{c} 不是数值' for c in self.res.columns
+                             if c != 'date' and not pd.api.types.is_numeric_dtype(self.res[c])]
+        if {'value', 'vol', 'vor', 'tor'}.issubset(self.res.columns) and not report['schema']:
+            # 元/手/价格 约为100(每手100股)，千元时约为0.1；换手率不会是负数
+            ratio = self.res['vor'] / (self.res['vol'] * self.res['value'])
+            report['tushare'] = sorted(dates[(ratio < 1) | (self.res['tor'] < 0)].unique())
+        return report
+
+    def Gap_Ranges(self, dates):
+        """把需要重拉的日期合并成尽量少的[开始, 结束]区间，相隔不超过GAP_MERGE个交易日的并在一起"""
+        if not dates:
+            return []
+        sessions = cal.sessions(dates[0].replace('-', ''), dates[-1].replace('-', ''))
+        pos = {f'{d[:4]}-{d[4:6]}-{d[6:]}': i for i, d in enumerate(sessions)}
+        runs = []
+        for d in dates:
+            i = pos.get(d, runs[-1][2] if runs else 0)
+            if runs and i - runs[-1][2] <= GAP_MERGE:
+                runs[-1][1], runs[-1][2] = d, i
+            else:
+                runs.append([d, d, i])
+        return [(start, end) for start, end, _ in runs]
+
+    def Repair_Gaps(self, report):
+        """按扫描结果就地修补：去重、修正tushare行、只重拉缺失的区间，再重算指标写回"""
+        if report['schema']:
+            # 列不对(多为老格式缺高开低)，无法局部修补，全量更新一次
             self.data = get_A_data_from_python(self.p_SN)
-            # with pd.read_csv(file_name, encoding="utf-8-sig") as res:
-            res = pd.read_csv(file_name, encoding="utf-8-sig")
-            if not (set(self.data['close']) == set(res.value)):
-                user_input = input("if rm the csv : y / n: ")
-                if user_input.lower() == 'y':
-                    os.system('rm %s'%file_name)
+        else:
+            data = self.Res_To_Data().drop_duplicates('date', keep='last')
+            fix = data['date'].isin(report['tushare'])
+            data.loc[fix, 'vor'] = data.loc[fix, 'vor'] * 1000
+            data.loc[fix, 'tor'] = np.nan
+            targets = sorted(set(report['missing']) | set(report['tushare']))
+            patch = [get_A_data_from_python(self.p_SN, start_date=start.replace('-', ''), end_date=end.replace('-', ''))
+                     for start, end in self.Gap_Ranges(targets)]
+            patch = pd.concat(patch, ignore_index=True) if patch else data.iloc[:0]
+            data = pd.concat([data[~data['date'].isin(patch['date'])], patch], ignore_index=True)
+            self.data = data.sort_values('date').reset_index(drop=True)
+            # 数据源也没有的交易日记下来，下次扫描不再当作缺口
+            store.manifest.add_absent(self.p_SN, sorted(set(report['missing']) - set(patch['date'])))
+        if self.Build_Res():
+            store.write(self.p_SN, self.res, LINEAGE, self.State())
+            report['repaired'] = len(self.res)
+
+    def Latest(self):
+        """最新一行(单行DataFrame)，没有读入res时查清单"""
+        if self.res is not None:
+            return self.res.iloc[[-1]]
+        return store.last_row(self.p_SN).to_frame().T.infer_objects()
 
     def Get_SomeData(self, p_CT):
         if p_CT == 'kdj':
-            n_val = self.res.loc[self.res.index == self.res.index.size-1]
+            n_val = self.Latest()
             if n_val.K.values < k_limit and n_val.rsi.values < rsi_limit:
                 print(self.p_SN, self.p_name)
                 print(n_val)
@@ -265,83 +697,126 @@ class stock:
 
         plt.show()
     
+    def Series(self, values):
+        """指标库返回的数组按self.data的索引包成Series"""
+        return pd.Series(values, index=self.data.index)
+
     def Get_KDJ(self, N=KDJ_N, M1=KDJ_M1, M2=KDJ_M2):
         # 计算短期RSV（相对强弱值）：RSV = (C - Ln) / (Hn - Ln) * 100 其中，C是当前close价，Ln是n天内的最低价，Hn是n天内的最高价。
-        data = self.data.copy()
-        today = dt.now()
-        low_min = data['low'].rolling(N, min_periods=1).min()
-        high_max = data['high'].rolling(N, min_periods=1).max()
-        data['RSV'] = (data['close'] - low_min) / (high_max - low_min) * 100
-        data['K'] = data['RSV'].ewm(alpha=1/M1, adjust=False).mean()
-        data['D'] = data['K'].ewm(alpha=1/M2, adjust=False).mean()
-        data['J'] = 3 * data['K'] - 2 * data['D']
-        # self.res['K'] = data['K']
-        # self.res['D'] = data['D']
-        # self.res['J'] = data['J']
-        return data['K'],data['D'],data['J']
+        k, d, j = indicators.kdj(self.data['high'], self.data['low'], self.data['close'], N, M1, M2)
+        return self.Series(k), self.Series(d), self.Series(j)
 
     def Get_MACD(self, n_fast=MACD_FAST, n_slow=MACD_SLOW, n_signal=MACD_SIGNAL):
-        ema12 = self.data['close'].ewm(span=n_fast, adjust=False).mean()
-        ema26 = self.data['close'].ewm(span=n_slow, adjust=False).mean()
-        diff = ema12 - ema26
-        dea = diff.ewm(span=n_signal, adjust=False).mean()
-        macd = 2 * (diff - dea)
-        # self.res['macd'] = macd
-        # self.res['diff'] = diff
-        return macd, diff, dea
+        macd, diff, dea = indicators.macd(self.data['close'], n_fast, n_slow, n_signal)
+        return self.Series(macd), self.Series(diff), self.Series(dea)
 
     def Get_BOLL(self, n = BOLL_N, k = BOLL_K):
-        mid = self.data['close'].rolling(n).mean()
-        upper = mid + k * self.data['close'].rolling(n).std()
-        lower = mid - k * self.data['close'].rolling(n).std()
-        # self.res['boll_u'] = upper
-        # self.res['boll_m'] = mid
-        # self.res['boll_l'] = lower
-        return upper, mid, lower
+        upper, mid, lower = indicators.boll(self.data['close'], n, k)
+        return self.Series(upper), self.Series(mid), self.Series(lower)
     
     def Get_Rsi(self, window=RSI_WINDOW):
-        """Compute RSI indicator with proper handling of initial values"""
-        delta = self.data['close'].diff()
-        gain = delta.copy()
-        loss = delta.copy()
+        return self.Series(indicators.rsi(self.data['close'], window))
+    
+    def Get_OBV(self):
+        """计算OBV指标"""
+        return self.Series(indicators.obv(self.data['close'], self.data['vol']))
 
-        gain[gain < 0] = 0
-        loss[loss > 0] = 0
-        loss = abs(loss)
+def fetch_stock(p_SN, flag=False):
+    """线程池worker：只负责读本地数据和拉行情，指标计算留给主线程"""
+    st = stock(p_SN, '')
+    if st.Need_Update(flag):
+        st.Fetch_Data()
+    return st
 
-        # First value is sum of gains or losses
-        avg_gain = gain.rolling(window=window, min_periods=1).mean()
-        avg_loss = loss.rolling(window=window, min_periods=1).mean()
+def scan_gaps_all(sns, workers=FETCH_WORKERS, repair=True):
+    """批量扫描缺口并修补，最后输出汇总"""
+    def scan(sn):
+        st = stock(sn, '')
+        report = st.Scan_Gaps()
+        if repair and any(report[k] for k in ('missing', 'duplicate', 'schema', 'tushare')):
+            st.Repair_Gaps(report)
+        return report
 
-        rs = avg_gain / (avg_loss + 1e-6)  # Avoid division by zero
-        rsi = 100 - (100 / (1 + rs))
+    start = time.perf_counter()
+    counts = {'ok': 0, 'missing': 0, 'duplicate': 0, 'schema': 0, 'tushare': 0, 'repaired': 0, 'failed': 0}
+    for sn, report, err in fetch_all(sns, scan, workers=workers):
+        if err is not None:
+            counts['failed'] += 1
+            print(f"{sn}: 扫描失败 {err}")
+            continue
+        issues = {k: report[k] for k in ('missing', 'duplicate', 'schema', 'tushare') if report[k]}
+        if not issues:
+            counts['ok'] += 1
+            continue
+        for k in issues:
+            counts[k] += 1
+        counts['repaired'] += bool(report['repaired'])
+        print(f"{sn}: " + ", ".join(f"{k} {len(v)}({v[0]}...)" for k, v in issues.items())
+              + (" 已修补" if report['repaired'] else ""))
+    print(f"扫描 {len(sns)} 只, 耗时 {time.perf_counter() - start:.1f}s: 正常 {counts['ok']}, "
+          f"缺交易日 {counts['missing']}, 重复日期 {counts['duplicate']}, 列不一致 {counts['schema']}, "
+          f"tushare旧格式 {counts['tushare']}, 已修补 {counts['repaired']}, 失败 {counts['failed']}")
+    return counts
 
-        return rsi
-    
-    def Get_OBV(self):
-        """计算OBV指标"""
-        if self.res is None or len(self.res) < 2:
-            return pd.Series([0] * len(self.res) if self.res is not None else [])
-        
-        data = self.res.copy()
-        obv = [0.0] * len(data)
-        
-        for i in range(1, len(data)):
-            try:
-                current_close = data.iloc[i]['close']
-                prev_close = data.iloc[i-1]['close']
-                current_vol = data.iloc[i]['vol']
-                
-                if current_close > prev_close:
-                    obv[i] = obv[i-1] + current_vol
-                elif current_close < prev_close:
-                    obv[i] = obv[i-1] - current_vol
-                else:
-                    obv[i] = obv[i-1]
-            except:
-                obv[i] = obv[i-1]
-        
-        return pd.Series(obv)
+def rebuild_panel(sns, chunk=PANEL_CHUNK):
+    """
+    全市场重算全部指标：每批chunk只股票的本地行情按日期对齐成 日期×股票 的矩阵，
+    用indicators.compute_panel一次算完再逐只写回；不联网，流式状态作废，下次追加时重放
+    """
+    start = time.perf_counter()
+    done, skipped = 0, []
+    for i in range(0, len(sns), chunk):
+        frames = {}
+        for sn in sns[i:i + chunk]:
+            res = store.read(sn)
+            if not set(OHLC_COLS).issubset(res.columns) or res['date'].duplicated().any():
+                skipped.append(sn)
+            elif len(res):
+                frames[sn] = res
+        if not frames:
+            continue
+        dates = np.unique(np.concatenate([res['date'].to_numpy(dtype=str) for res in frames.values()]))
+        rows = {sn: np.searchsorted(dates, res['date'].to_numpy(dtype=str)) for sn, res in frames.items()}
+        matrix = {col: np.full((len(dates), len(frames)), np.nan) for col in ('value', 'high', 'low', 'vol')}
+        for j, (sn, res) in enumerate(frames.items()):
+            for col, values in matrix.items():
+                values[rows[sn], j] = res[col].to_numpy(dtype='float64')
+        out = indicators.compute_panel(matrix['value'], matrix['high'], matrix['low'], matrix['vol'],
+                                       INDICATOR_PARAMS)
+        for j, (sn, res) in enumerate(frames.items()):
+            for name, cols in INDICATOR_COLUMNS.items():
+                for col, values in zip(cols, out[name]):
+                    res[col] = values[rows[sn], j]
+            store.write(sn, res, LINEAGE)
+            done += 1
+    print(f"全市场重算完成: {done} 只, 耗时 {time.perf_counter() - start:.1f}s; "
+          f"缺少高开低或有重复日期跳过的 {len(skipped)} 只(可先 --gaps 修补)")
+    return done
+
+def verify_all(sns, workers=FETCH_WORKERS, repair=True):
+    """批量校验并修复，最后输出汇总"""
+    start = time.perf_counter()
+    counts = {'ok': 0, 'corrupt': 0, 'probe': 0, 'repaired': 0, 'failed': 0}
+    problems = []
+    for sn, report, err in fetch_all(sns, lambda sn: stock(sn, '').Verify(repair=repair), workers=workers):
+        if err is not None:
+            counts['failed'] += 1
+            problems.append(f"{sn}: 校验失败 {err}")
+            continue
+        if not report['corrupt'] and not report['probe']:
+            counts['ok'] += 1
+            continue
+        counts['corrupt'] += bool(report['corrupt'])
+        counts['probe'] += bool(report['probe'])
+        counts['repaired'] += bool(report['repaired'])
+        problems.append(f"{sn}: 校验和不一致 {report['corrupt']}, 抽查不一致 {report['probe']}, "
+                        f"已修复 {report['repaired']}")
+    for line in problems:
+        print(line)
+    print(f"校验 {len(sns)} 只, 耗时 {time.perf_counter() - start:.1f}s: 正常 {counts['ok']}, "
+          f"校验和不一致 {counts['corrupt']}, 抽查不一致 {counts['probe']}, "
+          f"已修复 {counts['repaired']}, 失败 {counts['failed']}")
+    return counts
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -357,47 +832,93 @@ if __name__ == "__main__":
     parser.add_argument('--rd', action="store_const", const=True, default = False)
     parser.add_argument('--fd', type=str, default = '')
     parser.add_argument("--flag", action="store_const", const=True, default = False)
+    parser.add_argument('--workers', type=int, default = FETCH_WORKERS)
+    parser.add_argument('--up', action="store_const", const=True, default = False)
+    parser.add_argument('--up_start', type=str, default = None)
+    parser.add_argument('--cache', action="store_const", const=True, default = False)
+    parser.add_argument('--rebuild', action="store_const", const=True, default = False)
+    parser.add_argument('--no_repair', action="store_const", const=True, default = False)
+    parser.add_argument('--gaps', type=str, default = '')
+    parser.add_argument('--rebuild_all', action="store_const", const=True, default = False)
+    parser.add_argument('--ind_cache', action="store_const", const=True, default = False)
+    parser.add_argument('--ind_cache_disk', action="store_const", const=True, default = False)
     args = parser.parse_args()
+    if args.cache:
+        providers.enable_cache()
+    if args.ind_cache or args.ind_cache_disk:
+        # 同一进程(加磁盘层时跨进程)里相同输入和参数的指标只算一次
+        indicators.enable_cache(disk_dir=indicator_cache.DISK_DIR if args.ind_cache_disk else None)
+    if args.rebuild:
+        rebuilt, legacy = 0, []
+        for sn in store.symbols():
+            names = stock(sn, '').Rebuild()
+            if names is None:
+                legacy.append(sn)
+            elif names:
+                rebuilt += 1
+                print(sn, '重算', ','.join(names))
+        print(f"本地重算完成: {rebuilt} 只; 缺少高开低需联网全量更新的 {len(legacy)} 只")
+    if args.rebuild_all:
+        rebuild_panel(store.symbols())
+    if args.up:
+        bulk_update(args.up_start)
     if args.rd:
         if args.rd:
             # with open('/Users/zack-pc/zack/market/market/mystock/import', 'r', encoding='utf-8') as file:
                 # fp = file.read()
-                rd_res = pd.DataFrame(columns=['sn', 'name', 'last', 'high', 'open', 'now', 'boll_m', 'K', 'rsi', 'xx', 'err'])
-                count = 0
-                # for i in fp.split('\n'):
-                for i in buy_list.split('\n')[1:-1]:
-                    sn = i.split(' ')[0]
-                    name = i.split(' ')[1]
-                    st = stock(sn, name)
-                    file_name = f'/opt/zack/master/data/{sn}.csv'
-                    file_data = pd.read_csv(file_name, encoding="utf-8-sig")
-                    res = st.Read_import()
-                    rd_res.loc[count, 'sn'] = sn
-                    rd_res.loc[count, 'name'] = name
-                    rd_res.loc[count, 'last'] = d_last = res['last'].values
-                    rd_res.loc[count, 'high'] = res['high'].values
-                    rd_res.loc[count, 'open'] =  res['open'].values
-                    rd_res.loc[count, 'now'] = d_now = res['close'].values
-                    rd_res.loc[count, 'xx'] = (d_now - d_last) / d_last
-                    rd_res.loc[count, 'boll_m'] = boll_m = file_data.iloc[-1]['boll_m']
-                    rd_res.loc[count, 'K'] = K = file_data.iloc[-1]['K']
-                    rd_res.loc[count, 'rsi'] = rsi = file_data.iloc[-1]['rsi']
-                    rd_res.loc[count, 'err'] = d_now < boll_m and K > 50
-                    count += 1
-                rd_res['xx'] = list(map(lambda x: f"{x:.2%}", rd_res['xx']))
-                rd_res['K'] = list(map(lambda x: f"{x:.2f}", rd_res['K']))
-                rd_res['rsi'] = list(map(lambda x: f"{x:.2f}", rd_res['rsi']))
-                rd_res['boll_m'] = list(map(lambda x: f"{x:.2f}", rd_res['boll_m']))
+                watch = pd.DataFrame([i.split(' ')[:2] for i in buy_list.split('\n')[1:-1]], columns=['sn', 'name'])
+                # 一次批量拉取整个自选列表的实时行情，再和本地最新的指标快照做连接
+                quotes = get_realtime_quotes(watch['sn'].tolist())
+                snap = store.latest(watch['sn'].tolist())[['boll_m', 'K', 'rsi']].astype(float)
+                rd_res = watch.join(quotes, on='sn').join(snap, on='sn').rename(columns={'close': 'now'})
+                rd_res['xx'] = (rd_res['now'] - rd_res['last']) / rd_res['last']
+                rd_res['err'] = (rd_res['now'] < rd_res['boll_m']) & (rd_res['K'] > 50)
+                rd_res = rd_res.reindex(columns=['sn', 'name', 'last', 'high', 'open', 'now', 'boll_m', 'K', 'rsi', 'xx', 'err'])
+                rd_res['xx'] = rd_res['xx'].map(lambda x: f"{x:.2%}")
+                rd_res['K'] = rd_res['K'].map(lambda x: f"{x:.2f}")
+                rd_res['rsi'] = rd_res['rsi'].map(lambda x: f"{x:.2f}")
+                rd_res['boll_m'] = rd_res['boll_m'].map(lambda x: f"{x:.2f}")
                 print(rd_res)
-    if args.sn or args.ck:
+    if args.gaps:
+        # all 扫描存储里的全部股票，否则为逗号分隔的代码
+        scan_gaps_all(store.symbols() if args.gaps == 'all' else args.gaps.split(','),
+                      workers=args.workers, repair=not args.no_repair)
+    if args.ck:
+        # all 校验存储里的全部股票，否则为逗号分隔的代码
+        verify_all(store.symbols() if args.ck == 'all' else args.ck.split(','),
+                   workers=args.workers, repair=not args.no_repair)
+    if args.sn:
         if args.sn == 'all':
             p_list = get_all_stocks_today()
-            for i in p_list:
-                # print(i)
-                p_SN = i
-                st = stock(p_SN, '')
-                st.Get_Data(flag=args.flag)
-                st.Get_SomeData(args.ct)
+            # 行情并发拉取，每只拉完就在主线程计算指标并落盘
+            fetch = lambda sn: fetch_stock(sn, args.flag)
+            start = time.perf_counter()
+            # 拉取失败和计算/写入失败都只记下这一只，不中断全市场更新
+            failed = []
+            for p_SN, st, err in fetch_all(p_list, fetch, workers=args.workers):
+                if err is not None:
+                    print(f"获取{p_SN}数据失败: {err}")
+                    failed.append(p_SN)
+                    continue
+                try:
+                    st.Get_Data(flag=args.flag, load=False)
+                    st.Get_SomeData(args.ct)
+                except Exception as e:
+                    print(f"处理{p_SN}数据失败: {e}")
+                    failed.append(p_SN)
+            elapsed = time.perf_counter() - start
+            print(f"共 {len(p_list)} 只, 失败 {len(failed)} 只, 耗时 {elapsed:.1f}s, "
+                  f"{len(p_list) / max(elapsed, 1e-9):.1f} 只/秒")
+            if failed:
+                print("失败:", ','.join(failed))
+            print(transport.report())
+            print(router.report())
+            if providers.response_cache is not None:
+                print(providers.response_cache.report())
+            if providers.fixture_store is not None:
+                print(providers.fixture_store.report())
+            if indicators.cache is not None:
+                print(indicators.cache.report())
             sys.exit()
         for i in p_list.split('\n')[2:-1]:
             if args.sn == 'group1' or args.sn == i.split(' ')[0]:
@@ -420,12 +941,6 @@ if __name__ == "__main__":
                         sig.plot_price_and_macd(sig.res)
                         sig.plot_returns_comparison(sig.res)
                         sig.plot_returns_distribution(sig.res)
-            if args.ck == 'all' or args.ck == i.split(' ')[0]:
-                p_SN = i.split(' ')[0]
-                p_name = i.split(' ')[1]
-                st = stock(p_SN, p_name)
-                # print(self.p_SN, self.p_name)
-                st.Check_Data()
     if args.fd:
         sum,count,win_count = 0,0,0
         tm_all = 0
@@ -443,6 +958,8 @@ if __name__ == "__main__":
                 tm_all += tm
         print(f"\ntotal:{count}, avg:{sum/count}, win:{win_count/count*100:.2f}")
         print(f"\ntotal:{count}, avg:{sum/count}, win:{win_count/count*100:.2f}, tm_all:{tm_all/count:.2f}")
+    if indicators.cache is not None:
+        print(indicators.cache.report())
     # st = stock(args.sn, args.ct, args.st)
     # st.Show_plt()
     # st.Get_MACD()
@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+# manifest.py
+
+import json
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+
+MANIFEST_FILE = 'manifest.sqlite'
+# 分段校验和只覆盖原始行情列，重算指标不改变分段校验和
+RANGE_COLUMNS = ['date', 'value', 'vol', 'vor', 'tor', 'open', 'high', 'low']
+
+def row_hashes(df):
+    """每行的哈希(uint64)，与列顺序、dtype(整数/浮点)无关"""
+    canon = df[sorted(df.columns)].copy()
+    for col in canon.columns:
+        canon[col] = canon[col].astype(object if col == 'date' else 'float64')
+    canon['date'] = canon['date'].astype(str).astype(object)
+    return pd.util.hash_pandas_object(canon, index=False).to_numpy()
+
+def frame_checksum(df):
+    """
+    内容校验和：每行哈希之和(mod 2^64)
+    追加新行时用旧值加上新行的校验和即可，不用重读全部数据
+    """
+    return int(row_hashes(df).sum(dtype=np.uint64))
+
+def range_checksums(df):
+    """按月(YYYY-MM)分段的 {月份: (行数, 校验和)}，只用RANGE_COLUMNS"""
+    if df.empty:
+        return {}
+    hashes = row_hashes(df[[c for c in RANGE_COLUMNS if c in df.columns]])
+    codes, periods = pd.factorize(df['date'].astype(str).str[:7])
+    sums = np.zeros(len(periods), dtype=np.uint64)
+    np.add.at(sums, codes, hashes)
+    counts = np.bincount(codes, minlength=len(periods))
+    return {p: (int(n), int(s)) for p, n, s in zip(periods, counts, sums)}
+
+def add_checksum(a, b):
+    return (a + b) % 2 ** 64
+
+def row_json(row):
+    return json.dumps(row.to_dict(), ensure_ascii=False, default=lambda v: v.item())
+
+class Manifest:
+    """
+    数据目录的清单(SQLite)：每只股票的最后日期、行数、校验和、最后一行的全部字段，
+    以及各派生列由哪个指标、什么参数和算法版本算出(lineage)、流式指标的状态(state)
+    判断是否过期、取最新指标只需查这张表，不用解析数据文件
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS manifest ("
+                "sn TEXT PRIMARY KEY, last_date TEXT, rows INTEGER, checksum TEXT, latest TEXT, lineage TEXT, "
+                "state TEXT)")
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(manifest)")]
+            for column in ('lineage', 'state'):
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE manifest ADD COLUMN {column} TEXT")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS ranges ("
+                "sn TEXT, period TEXT, rows INTEGER, checksum TEXT, PRIMARY KEY (sn, period)) WITHOUT ROWID")
+            # 缺口扫描时数据源确认没有数据的交易日(停牌等)，之后不再当作缺口
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS absent (sn TEXT, date TEXT, PRIMARY KEY (sn, date)) WITHOUT ROWID")
+
+    def get(self, sn):
+        """返回 (last_date, rows, checksum, latest字典)，没有记录时返回None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT last_date, rows, checksum, latest FROM manifest WHERE sn = ?", (sn,)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], int(row[2], 16), json.loads(row[3])
+
+    def lineage(self, sn):
+        """{列名: {'indicator', 'params', 'version'}}，没有记录时返回空字典"""
+        with self.lock:
+            row = self.conn.execute("SELECT lineage FROM manifest WHERE sn = ?", (sn,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+
+    def state(self, sn):
+        """流式指标的状态，没有记录时返回None"""
+        with self.lock:
+            row = self.conn.execute("SELECT state FROM manifest WHERE sn = ?", (sn,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def replace(self, sn, df, lineage=None, state=None):
+        """整体重写后更新；lineage为None时保留原来的记录，state与数据一起更新，None表示作废"""
+        self.put(sn, df, len(df), frame_checksum(df), lineage, state)
+
+    def append(self, sn, rows, state=None):
+        """追加rows后更新；没有旧记录时返回False，由调用方整体重建"""
+        with self.lock, self.conn:
+            old = self.conn.execute("SELECT rows, checksum FROM manifest WHERE sn = ?", (sn,)).fetchone()
+            if old is None:
+                return False
+            self.conn.execute(
+                "UPDATE manifest SET last_date = ?, rows = ?, checksum = ?, latest = ?, state = ? WHERE sn = ?",
+                (rows['date'].iloc[-1], old[0] + len(rows),
+                 f'{add_checksum(int(old[1], 16), frame_checksum(rows)):016x}', row_json(rows.iloc[-1]),
+                 None if state is None else json.dumps(state), sn))
+            # 新行所在月份的分段校验和同样累加
+            for period, (n, checksum) in range_checksums(rows).items():
+                prev = self.conn.execute(
+                    "SELECT rows, checksum FROM ranges WHERE sn = ? AND period = ?", (sn, period)).fetchone()
+                if prev is not None:
+                    n, checksum = prev[0] + n, add_checksum(int(prev[1], 16), checksum)
+                self.conn.execute("INSERT OR REPLACE INTO ranges VALUES (?, ?, ?, ?)",
+                                  (sn, period, n, f'{checksum:016x}'))
+        return True
+
+    def absent(self, sn):
+        with self.lock:
+            return {row[0] for row in self.conn.execute("SELECT date FROM absent WHERE sn = ?", (sn,))}
+
+    def add_absent(self, sn, dates):
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO absent VALUES (?, ?)", [(sn, d) for d in dates])
+
+    def ranges(self, sn):
+        """记录的分段校验和 {月份: (行数, 校验和)}"""
+        with self.lock:
+            rows = self.conn.execute("SELECT period, rows, checksum FROM ranges WHERE sn = ?", (sn,)).fetchall()
+        return {period: (n, int(checksum, 16)) for period, n, checksum in rows}
+
+    def put(self, sn, df, n, checksum, lineage=None, state=None):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO manifest (sn, last_date, rows, checksum, latest, lineage, state) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(sn) DO UPDATE SET last_date = excluded.last_date, rows = excluded.rows, "
+                "checksum = excluded.checksum, latest = excluded.latest, "
+                "lineage = COALESCE(excluded.lineage, manifest.lineage), state = excluded.state",
+                (sn, df['date'].iloc[-1] if n else None, n, f'{checksum:016x}',
+                 row_json(df.iloc[-1]) if n else '{}',
+                 None if lineage is None else json.dumps(lineage, sort_keys=True),
+                 None if state is None else json.dumps(state)))
+            self.conn.execute("DELETE FROM ranges WHERE sn = ?", (sn,))
+            self.conn.executemany("INSERT INTO ranges VALUES (?, ?, ?, ?)",
+                                  [(sn, period, rows, f'{checksum:016x}')
+                                   for period, (rows, checksum) in range_checksums(df).items()])
+
+    def remove(self, sn):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM manifest WHERE sn = ?", (sn,))
+            self.conn.execute("DELETE FROM ranges WHERE sn = ?", (sn,))
+
+    def last_dates(self):
+        """{sn: 最后日期}"""
+        with self.lock:
+            return dict(self.conn.execute("SELECT sn, last_date FROM manifest WHERE last_date IS NOT NULL"))
+
+    def latest(self, sns=None):
+        """以sn为索引的最新一行DataFrame；sns为None时返回全部"""
+        with self.lock:
+            if sns is None:
+                rows = self.conn.execute("SELECT sn, latest FROM manifest").fetchall()
+            else:
+                sns = list(sns)
+                rows = []
+                for i in range(0, len(sns), 500):
+                    part = sns[i:i + 500]
+                    rows += self.conn.execute(
+                        f"SELECT sn, latest FROM manifest WHERE sn IN ({','.join('?' * len(part))})", part).fetchall()
+        return pd.DataFrame.from_dict({sn: json.loads(latest) for sn, latest in rows}, orient='index')
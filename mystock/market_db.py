@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+# market_db.py
+
+import sqlite3
+import threading
+import argparse
+import time
+import pandas as pd
+
+DB_FILE = '/opt/zack/master/market.sqlite'
+# pro.daily 的字段，bars表按这个顺序存，date为YYYYMMDD
+BAR_COLUMNS = ['open', 'high', 'low', 'close', 'pre_close', 'change', 'pct_chg', 'vol', 'amount']
+CSV_CHUNK = 200000
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+class MarketDB:
+    """
+    嵌入式行情库(SQLite, WAL)
+    bars: 全市场日线，主键(symbol, date)，另建date索引，"某天全市场"和"某只股票某段时间"都走索引
+    series: 每只股票的res(行情+指标)，主键(symbol, date)，供store.SqliteStore使用
+    """
+
+    def __init__(self, db_path=DB_FILE):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS bars (symbol TEXT NOT NULL, date TEXT NOT NULL, "
+                + ", ".join(f"{c} REAL" for c in BAR_COLUMNS)
+                + ", PRIMARY KEY (symbol, date)) WITHOUT ROWID")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS bars_date ON bars (date)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS series (symbol TEXT NOT NULL, date TEXT NOT NULL, "
+                "PRIMARY KEY (symbol, date)) WITHOUT ROWID")
+        self.series_columns = self.table_columns('series')
+
+    def table_columns(self, table):
+        return [row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")][2:]
+
+    def ingest_daily(self, df):
+        """pro.daily格式(ts_code, trade_date, ...)批量写入bars，已有的(symbol, date)覆盖"""
+        if df is None or df.empty:
+            return 0
+        rows = df.reindex(columns=['ts_code', 'trade_date'] + BAR_COLUMNS)
+        rows['trade_date'] = rows['trade_date'].astype(str)
+        rows = rows.astype(object).where(rows.notna(), None)
+        with self.lock, self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO bars VALUES ({','.join('?' * (len(BAR_COLUMNS) + 2))})",
+                rows.itertuples(index=False, name=None))
+        return len(rows)
+
+    def ingest_csv(self, file_path, chunksize=CSV_CHUNK):
+        """分块导入 GetHistory 生成的 history_*.csv"""
+        total = 0
+        for chunk in pd.read_csv(file_path, encoding='utf-8-sig', chunksize=chunksize):
+            total += self.ingest_daily(chunk)
+        return total
+
+    def query_bars(self, where, params):
+        with self.lock:
+            return pd.read_sql_query(
+                f"SELECT symbol AS ts_code, date AS trade_date, {', '.join(BAR_COLUMNS)} FROM bars WHERE {where}",
+                self.conn, params=params)
+
+    def bars_on(self, date):
+        """某个交易日的全市场日线(date为YYYYMMDD)，走date索引"""
+        return self.query_bars("date = ? ORDER BY symbol", (date,))
+
+    def bars_for(self, symbol, start_date=None, end_date=None):
+        """单只股票[start_date, end_date]的日线(ts_code如000001.SZ)，走主键"""
+        return self.query_bars("symbol = ? AND date >= ? AND date <= ? ORDER BY date",
+                               (symbol, start_date or '00000000', end_date or '99999999'))
+
+    def bar_symbols(self):
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT DISTINCT symbol FROM bars ORDER BY symbol")]
+
+    def bar_date_range(self):
+        with self.lock:
+            return self.conn.execute("SELECT MIN(date), MAX(date) FROM bars").fetchone()
+
+    def ensure_series_columns(self, columns):
+        """series表按res的列动态加列"""
+        missing = [c for c in columns if c != 'date' and c not in self.series_columns]
+        if missing:
+            with self.lock, self.conn:
+                for c in missing:
+                    self.conn.execute(f"ALTER TABLE series ADD COLUMN {quote(c)} REAL")
+            self.series_columns = self.table_columns('series')
+
+    def put_series(self, symbol, df, replace=False):
+        """写入一只股票的res；replace=True时先删掉这只股票原有的行"""
+        self.ensure_series_columns(df.columns)
+        columns = ['date'] + [c for c in df.columns if c != 'date']
+        rows = df[columns].astype(object).where(df[columns].notna(), None)
+        sql = (f"INSERT OR REPLACE INTO series (symbol, {', '.join(quote(c) for c in columns)}) "
+               f"VALUES (?, {','.join('?' * len(columns))})")
+        with self.lock, self.conn:
+            if replace:
+                self.conn.execute("DELETE FROM series WHERE symbol = ?", (symbol,))
+            self.conn.executemany(sql, ((symbol,) + row for row in rows.itertuples(index=False, name=None)))
+
+    def get_series(self, symbol, columns=None):
+        columns = columns or ['date'] + self.series_columns
+        with self.lock:
+            df = pd.read_sql_query(
+                f"SELECT {', '.join(quote(c) for c in columns)} FROM series WHERE symbol = ? ORDER BY date",
+                self.conn, params=(symbol,))
+        numeric = [c for c in df.columns if c != 'date']
+        df[numeric] = df[numeric].astype('float64')
+        return df
+
+    def delete_series(self, symbol):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM series WHERE symbol = ?", (symbol,))
+
+    def has_series(self, symbol):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM series WHERE symbol = ? LIMIT 1", (symbol,)).fetchone() is not None
+
+    def series_symbols(self):
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT DISTINCT symbol FROM series ORDER BY symbol")]
+
+    def last_series_row(self, symbol):
+        with self.lock:
+            df = pd.read_sql_query(
+                f"SELECT {', '.join(quote(c) for c in ['date'] + self.series_columns)} FROM series "
+                "WHERE symbol = ? ORDER BY date DESC LIMIT 1", self.conn, params=(symbol,))
+        return None if df.empty else df.iloc[0]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', type=str, default = DB_FILE)
+    parser.add_argument('--csv', type=str, nargs='*', default = [])
+    args = parser.parse_args()
+    db = MarketDB(args.db)
+    for file_path in args.csv:
+        start = time.perf_counter()
+        n = db.ingest_csv(file_path)
+        print(f"{file_path}: 导入 {n} 条, 耗时 {time.perf_counter() - start:.1f}s")
+    print(f"{args.db}: {len(db.bar_symbols())} 只股票, 日期范围 {db.bar_date_range()}")
@@ -1,7 +1,11 @@
 import pandas as pd
 import numpy as np
-from pathlib import Path
 from my_name import group1_list
+from store import open_store
+import indicators
+import kernels
+
+store = open_store()
 
 class jiaoyi:
     def __init__(self, all_money = 10000):
@@ -20,10 +24,9 @@ class mystrategy:
     def __init__(self, p_SN, p_name):
         self.p_SN = p_SN
         self.p_name = p_name
-        file_name = f'/opt/zack/master/data/{self.p_SN}.csv'
         self.rd = pd.DataFrame()
-        if Path(file_name).is_file():
-            self.rd = pd.read_csv(file_name, encoding="utf-8-sig")
+        if store.exists(self.p_SN):
+            self.rd = store.read(self.p_SN)
             # print(rd.loc[rd.index == 0])
             # self.res = self.rd.loc[self.rd.index == 0]
             self.res = pd.DataFrame()
@@ -85,8 +88,7 @@ class mystrategy:
         """
         money flow analysis
         """
-        data = self.rd.copy()
-        data['VWAP'] = (data['vol'] * data['value']).cumsum() / data['vol'].cumsum()
+        data = self.rd.assign(VWAP=indicators.vwap(self.rd['value'], self.rd['vol']))
         
         latest = data.iloc[dt]
         macd_bullish = latest['diff'] > latest['dea']
@@ -110,64 +112,33 @@ class mystrategy:
         # return self.find_min_point()
         return self.way4()
 
+    def columns(self, *names):
+        return [self.rd[name].to_numpy('float64') for name in names]
+
+    def trades(self, result, min_col = False):
+        """状态机返回的交易记录整理成self.res，返回最终总资产"""
+        money_all, count, rows, side, total, cash, held, low = result
+        records = []
+        for j in range(count):
+            row = self.rd.iloc[rows[j]]
+            record = {'date': row['date'], 'value': row['value'], 'K': row['K'], 'rsi': row['rsi'],
+                      'money_all': total[j], 'money': cash[j], 'pick': held[j]}
+            if side[j] == 1:
+                record['buy'] = 1
+            else:
+                record['sell'] = 1
+                if min_col:
+                    record['min'] = low[j]
+            records.append(record)
+        self.res = pd.DataFrame(records)
+        return money_all
+
     def way1(self):
-        count_res = 0
-        money_all = money = 10000
-        pick = 0
-        flag_sell = 0
-        max_v = 0
         if self.rd.empty:
             return 0
-        for index, row in self.rd.iterrows():
-            if row['date'] < '2024':
-                continue
-            money_all = money + pick * row['value']
-            if row['K'] < 20 and row['rsi'] < 30 and pick == 0:
-                self.res.loc[count_res, 'date'] = row['date']
-                self.res.loc[count_res, 'value'] = row['value']
-                self.res.loc[count_res, 'K'] = row['K']
-                self.res.loc[count_res, 'rsi'] = row['rsi']
-                pick += 1 * money / row['value']
-                money = 0
-                self.res.loc[count_res, 'money_all'] = money_all
-                self.res.loc[count_res, 'money'] = money
-                self.res.loc[count_res, 'pick'] = pick
-                self.res.loc[count_res, 'buy'] = 1
-                count_res += 1
-                max_v = row['value']
-            # elif row['K'] < 10 and row['rsi'] < 20 and pick * row['value'] < 0.9 * money:
-            #     self.res.loc[count_res, 'date'] = row['date']
-            #     self.res.loc[count_res, 'value'] = row['value']
-            #     self.res.loc[count_res, 'K'] = row['K']
-            #     self.res.loc[count_res, 'rsi'] = row['rsi']
-            #     pick += money / row['value']
-            #     money = 0
-            #     self.res.loc[count_res, 'money_all'] = money_all
-            #     self.res.loc[count_res, 'money'] = money
-            #     self.res.loc[count_res, 'pick'] = pick
-            #     self.res.loc[count_res, 'buy'] = 1
-            #     count_res += 1
-            elif row['K'] > 80 and row['rsi'] > 80:
-                flag_sell = 1
-            elif ((row['K'] > 50 and row['value'] < row['boll_m']) or row['value'] < 0.9 * max_v) and pick > 0 and flag_sell == 1:
-                self.res.loc[count_res, 'date'] = row['date']
-                self.res.loc[count_res, 'value'] = row['value']
-                self.res.loc[count_res, 'K'] = row['K']
-                self.res.loc[count_res, 'rsi'] = row['rsi']
-                money += pick * row['value']
-                pick = 0
-                self.res.loc[count_res, 'money_all'] = money_all
-                self.res.loc[count_res, 'money'] = money
-                self.res.loc[count_res, 'pick'] = pick
-                self.res.loc[count_res, 'sell'] = 1
-                flag_sell = 0
-                count_res += 1
-            if pick > 0:
-                max_v = max(max_v, row['value'])
-            # else:
-            #     self.res.loc[count_res, 'date'] = row['date']
-            #     self.res.loc[count_res, 'value'] = row['value']
-            #     count_res += 1
+        # 逐行的买卖状态机在 kernels.way1 中(有numba时编译执行)
+        active = (self.rd['date'] >= '2024').to_numpy()
+        money_all = self.trades(kernels.way1(active, *self.columns('value', 'K', 'rsi', 'boll_m')))
         if money_all < 8500:
             print('\n',self.p_SN, self.p_name)
             print(self.res) 
@@ -176,74 +147,10 @@ class mystrategy:
         return money_all
     
     def way2(self):
-        count_res = 0
-        money_all = money = 10000
-        pick = 0
-        flag_sell = 0
-        max_v = 0
-        for index, row in self.rd.iterrows():
-            if row['date'] < '2025':
-                continue
-            signal = self.get_macd_money_flow_signal(index)
-            signal2 = self.comprehensive_money_flow_analysis(index)
-            money_all = money + pick * row['value']
-            if row['macd'] > 0 and row['diff'] > 0 and row['dea'] > 0 and pick == 0 and row['value'] > row['boll_u']:
-                self.res.loc[count_res, 'date'] = row['date']
-                self.res.loc[count_res, 'value'] = row['value']
-                self.res.loc[count_res, 'K'] = row['K']
-                self.res.loc[count_res, 'rsi'] = row['rsi']
-                pick += 1 * money / row['value']
-                money = 0
-                self.res.loc[count_res, 'money_all'] = money_all
-                self.res.loc[count_res, 'money'] = money
-                self.res.loc[count_res, 'pick'] = pick
-                self.res.loc[count_res, 'buy'] = 1
-                count_res += 1
-                max_v = row['value']
-            # elif pick * row['value'] < 0.9 * money and signal[0] > 0 and signal2[0] > 0:
-            #     self.res.loc[count_res, 'date'] = row['date']
-            #     self.res.loc[count_res, 'value'] = row['value']
-            #     self.res.loc[count_res, 'K'] = row['K']
-            #     self.res.loc[count_res, 'rsi'] = row['rsi']
-            #     pick += money / row['value']
-            #     money = 0
-            #     self.res.loc[count_res, 'money_all'] = money_all
-            #     self.res.loc[count_res, 'money'] = money
-            #     self.res.loc[count_res, 'pick'] = pick
-            #     self.res.loc[count_res, 'buy'] = 1
-            #     count_res += 1
-            elif ((row['value'] < row['boll_m']) or (0.9 * max_v < row['value'])) and pick > 0 :
-                self.res.loc[count_res, 'date'] = row['date']
-                self.res.loc[count_res, 'value'] = row['value']
-                self.res.loc[count_res, 'K'] = row['K']
-                self.res.loc[count_res, 'rsi'] = row['rsi']
-                money += pick * row['value']
-                pick = 0
-                self.res.loc[count_res, 'money_all'] = money_all
-                self.res.loc[count_res, 'money'] = money
-                self.res.loc[count_res, 'pick'] = pick
-                self.res.loc[count_res, 'sell'] = 1
-                flag_sell = 0
-                count_res += 1
-            # elif row['value'] < row['boll_m'] and pick > 0 and flag_sell == 1:
-            #     self.res.loc[count_res, 'date'] = row['date']
-            #     self.res.loc[count_res, 'value'] = row['value']
-            #     self.res.loc[count_res, 'K'] = row['K']
-            #     self.res.loc[count_res, 'rsi'] = row['rsi']
-            #     money += pick * row['value']
-            #     pick = 0
-            #     self.res.loc[count_res, 'money_all'] = money_all
-            #     self.res.loc[count_res, 'money'] = money
-            #     self.res.loc[count_res, 'pick'] = pick
-            #     self.res.loc[count_res, 'sell'] = 1
-            #     flag_sell = 0
-            #     count_res += 1
-            if pick > 0:
-                max_v = max(max_v, row['value'])
-            # else:
-            #     self.res.loc[count_res, 'date'] = row['date']
-            #     self.res.loc[count_res, 'value'] = row['value']
-            #     count_res += 1
+        if self.rd.empty:
+            return 10000
+        active = (self.rd['date'] >= '2025').to_numpy()
+        money_all = self.trades(kernels.way2(active, *self.columns('value', 'macd', 'diff', 'dea', 'boll_u', 'boll_m')))
         if money_all < 10000:
             print('\n',self.p_SN, self.p_name)
             print(self.res) 
@@ -252,61 +159,10 @@ class mystrategy:
         return money_all
     
     def way3(self):
-        count_res = 0
-        money_all = money = 10000
-        pick = 0
-        flag_sell = 0
-        max_v = 0
-        min_v = 999999
         if self.rd.empty:
             return 0
-        for index, row in self.rd.iterrows():
-            if row['date'] < '2021':
-                continue
-            money_all = money + pick * row['value']
-            # if row['K'] < 20 and row['rsi'] < 30 and pick == 0 and row['value'] < row['boll_l']:
-            if row['K'] < 20 and row['rsi'] < 30 and pick == 0:
-                self.res.loc[count_res, 'date'] = row['date']
-                self.res.loc[count_res, 'value'] = row['value']
-                self.res.loc[count_res, 'K'] = row['K']
-                self.res.loc[count_res, 'rsi'] = row['rsi']
-                pick += 1 * money / row['value']
-                money -= 1 * money
-                self.res.loc[count_res, 'money_all'] = money_all
-                self.res.loc[count_res, 'money'] = money
-                self.res.loc[count_res, 'pick'] = pick
-                self.res.loc[count_res, 'buy'] = 1
-                # self.res.loc[count_res, 'min'] = row['value']
-                count_res += 1
-                max_v = row['value']
-            elif row['K'] > 80 and row['rsi'] > 80:
-                flag_sell = 1
-            elif ((row['K'] > 50 and row['value'] < row['boll_m']) or row['value'] < 0.9 * max_v) and pick > 0 and flag_sell == 1:
-                self.res.loc[count_res, 'date'] = row['date']
-                self.res.loc[count_res, 'value'] = row['value']
-                self.res.loc[count_res, 'K'] = row['K']
-                self.res.loc[count_res, 'rsi'] = row['rsi']
-                money += pick * row['value']
-                pick = 0
-                self.res.loc[count_res, 'money_all'] = money_all
-                self.res.loc[count_res, 'money'] = money
-                self.res.loc[count_res, 'pick'] = pick
-                self.res.loc[count_res, 'sell'] = 1
-                self.res.loc[count_res, 'min'] = min_v
-                flag_sell = 0
-                # if self.res.loc[count_res-1, 'money_all'] > self.res.loc[count_res, 'money_all']:
-                #     print(self.p_SN, self.p_name)
-                #     print(self.res[count_res-1:count_res+1]) 
-                count_res += 1
-            if pick > 0:
-                max_v = max(max_v, row['value'])
-                min_v = min(min_v, row['value'])
-            else:
-                min_v = 999999
-            # else:
-            #     self.res.loc[count_res, 'date'] = row['date']
-            #     self.res.loc[count_res, 'value'] = row['value']
-            #     count_res += 1
+        active = (self.rd['date'] >= '2021').to_numpy()
+        money_all = self.trades(kernels.way3(active, *self.columns('value', 'K', 'rsi', 'boll_m')), min_col = True)
         if money_all > 5000:
             print('\n',self.p_SN, self.p_name)
             print(self.res) 
@@ -317,26 +173,10 @@ class mystrategy:
     def way4(self):
         if self.rd.empty:
             return 0
-        jy = jiaoyi()
-        loop = []
-        min_v = 999999
-        for index, row in self.rd.iterrows():
-            if row['date'] < '2025':
-                continue
-            all_p = jy.all_money / row['value']
-            if row['K'] < 20 and row['rsi'] < 20 and row['value'] < row['boll_l'] and jy.all_money > 0:
-                jy.buy(row['value'], all_p)
-                loop.append([row['date'], row['value'], row['K'], row['rsi']])
-            if row['K'] > 80 and row['rsi'] > 80 and row['value'] > row['boll_m'] and jy.pick > 0:
-                jy.sell(row['value'], jy.pick)
-                loop.append([row['date'], row['value'], row['K'], row['rsi'], min_v])
-                min_v = 999999
-            if jy.pick > 0:
-                min_v = min(min_v, row['value'])
-        
+        active = (self.rd['date'] >= '2025').to_numpy()
+        # 交易记录(原来的loop列表)在self.res中
+        money_all = self.trades(kernels.way4(active, *self.columns('value', 'K', 'rsi', 'boll_l', 'boll_m')), min_col = True)
         # self.res.to_csv("res.csv", index=False, encoding='utf-8-sig')
-        money_all = jy.all_money + jy.pick * self.rd.iloc[-1]['value']
-        # print(loop)
         return money_all
     
     def find_min_point(self):
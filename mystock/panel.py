@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+# panel.py
+
+import os
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import numpy as np
+import pandas as pd
+from pathlib import Path
+import indicators
+
+PANEL_DIR = '/opt/zack/master/panel'
+# pro.daily字段 -> 面板字段
+FIELDS = {
+    'open': 'open',
+    'high': 'high',
+    'low': 'low',
+    'close': 'close',
+    'pre_close': 'pre_close',
+    'change': 'change',
+    'vol': 'vol',
+    'amount': 'amount',
+    'pct_chg': 'pct_change',
+}
+PANEL_DTYPE = 'float64'
+CHUNK = 200000
+
+def source_chunks(source, columns, chunksize=CHUNK):
+    """按块读取 history_*.csv 或行情库(.sqlite)的bars表，列名统一为pro.daily格式"""
+    if str(source).endswith('.sqlite'):
+        conn = sqlite3.connect(source)
+        select = ', '.join({'ts_code': 'symbol AS ts_code', 'trade_date': 'date AS trade_date'}.get(c, c)
+                           for c in columns)
+        try:
+            yield from pd.read_sql_query(f"SELECT {select} FROM bars", conn, chunksize=chunksize)
+        finally:
+            conn.close()
+    else:
+        yield from pd.read_csv(source, encoding='utf-8-sig', usecols=columns,
+                               dtype={'trade_date': str}, chunksize=chunksize)
+
+def build_panel(source, panel_dir=PANEL_DIR):
+    """
+    把长表(每行一只股票一天)转成 日期×股票 的面板，每个字段一个.npy，读取时按mmap打开
+    第一遍只读代码和日期建字典，第二遍按块把数值填进预先分配的数组，内存占用与数据量无关
+    先在临时目录生成，完成后替换原目录
+    """
+    symbols, dates = set(), set()
+    for chunk in source_chunks(source, ['ts_code', 'trade_date']):
+        symbols.update(chunk['ts_code'].unique())
+        dates.update(chunk['trade_date'].astype(str).unique())
+    symbols = np.array(sorted(symbols))
+    dates = np.array(sorted(dates))
+
+    out = Path(f'{panel_dir}.tmp')
+    shutil.rmtree(out, ignore_errors=True)
+    out.mkdir(parents=True)
+    arrays = {}
+    for name in FIELDS.values():
+        arrays[name] = np.lib.format.open_memmap(out / f'{name}.npy', mode='w+', dtype=PANEL_DTYPE,
+                                                 shape=(len(dates), len(symbols)))
+        arrays[name][:] = np.nan
+    for chunk in source_chunks(source, ['ts_code', 'trade_date'] + list(FIELDS)):
+        i = np.searchsorted(dates, chunk['trade_date'].astype(str).to_numpy())
+        j = np.searchsorted(symbols, chunk['ts_code'].to_numpy())
+        for col, name in FIELDS.items():
+            arrays[name][i, j] = chunk[col].to_numpy(dtype=PANEL_DTYPE)
+    for arr in arrays.values():
+        arr.flush()
+    np.save(out / 'dates.npy', pd.to_datetime(dates, format='%Y%m%d').to_numpy().astype('datetime64[D]'))
+    np.save(out / 'symbols.npy', symbols)
+    with open(out / 'meta.json', 'w', encoding='utf-8') as f:
+        json.dump({'fields': list(FIELDS.values()), 'dtype': PANEL_DTYPE,
+                   'shape': [len(dates), len(symbols)], 'source': str(source)}, f, ensure_ascii=False)
+    del arrays
+    shutil.rmtree(panel_dir, ignore_errors=True)
+    os.replace(out, panel_dir)
+    return len(dates), len(symbols)
+
+def is_panel(path):
+    return (Path(path) / 'meta.json').is_file()
+
+class Panel:
+    """
+    日期×股票 面板的只读视图
+    打开时只读日期和代码字典，各字段数组按mmap映射，查询时才把用到的切片读进内存
+    """
+
+    def __init__(self, panel_dir=PANEL_DIR):
+        self.panel_dir = Path(panel_dir)
+        with open(self.panel_dir / 'meta.json', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.dates = np.load(self.panel_dir / 'dates.npy')
+        self.symbols = np.load(self.panel_dir / 'symbols.npy')
+        self.symbol_index = {s: j for j, s in enumerate(self.symbols)}
+        self.fields = {name: np.load(self.panel_dir / f'{name}.npy', mmap_mode='r')
+                       for name in self.meta['fields']}
+
+    def date_slice(self, start_date=None, end_date=None):
+        start = 0 if start_date is None else np.searchsorted(self.dates, np.datetime64(pd.to_datetime(start_date).date()))
+        end = len(self.dates) if end_date is None else np.searchsorted(self.dates, np.datetime64(pd.to_datetime(end_date).date()), side='right')
+        return slice(start, end)
+
+    def window(self, field, start_date=None, end_date=None, symbols=None):
+        """某字段在日期区间内的二维数组(日期×股票)，symbols为None时取全部股票"""
+        sl = self.date_slice(start_date, end_date)
+        if symbols is None:
+            return self.fields[field][sl]
+        return self.fields[field][sl][:, [self.symbol_index[s] for s in symbols]]
+
+    def symbol_frame(self, symbol, start_date=None, end_date=None):
+        """单只股票的区间数据，以日期为索引；不存在时返回None"""
+        j = self.symbol_index.get(symbol)
+        if j is None:
+            return None
+        sl = self.date_slice(start_date, end_date)
+        df = pd.DataFrame({name: arr[sl, j] for name, arr in self.fields.items()},
+                          index=pd.DatetimeIndex(self.dates[sl], name='date'))
+        return df.dropna(how='all')
+
+    def compute_indicators(self, start_date=None, end_date=None, symbols=None, params=indicators.PARAMS):
+        """
+        区间内全部(或指定)股票的指标，一次二维计算，返回 {指标名: 各列 日期×股票 数组的元组}
+        区间之前的历史不参与计算，EMA类指标从区间第一天起算
+        """
+        return indicators.compute_panel(*(self.window(field, start_date, end_date, symbols)
+                                          for field in ('close', 'high', 'low', 'vol')), params)
+
+    def date_frame(self, date):
+        """某个交易日全市场的数据，以股票代码为索引；不是交易日时返回空表"""
+        day = np.datetime64(pd.to_datetime(date).date())
+        i = np.searchsorted(self.dates, day)
+        if i >= len(self.dates) or self.dates[i] != day:
+            return pd.DataFrame(columns=list(self.fields))
+        df = pd.DataFrame({name: arr[i] for name, arr in self.fields.items()},
+                          index=pd.Index(self.symbols, name='symbol'))
+        return df.dropna(how='all')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--src', type=str, default = None, help='history_*.csv 或行情库 .sqlite，不给时只打开已有面板')
+    parser.add_argument('--out', type=str, default = PANEL_DIR)
+    parser.add_argument('--indicators', action="store_const", const=True, default = False)
+    args = parser.parse_args()
+    if args.src:
+        start = time.perf_counter()
+        n_dates, n_symbols = build_panel(args.src, args.out)
+        print(f"面板已生成到 {args.out}: {n_dates} 天 × {n_symbols} 只, 耗时 {time.perf_counter() - start:.1f}s")
+    start = time.perf_counter()
+    panel = Panel(args.out)
+    print(f"打开耗时 {(time.perf_counter() - start) * 1000:.1f}ms")
+    if args.indicators:
+        start = time.perf_counter()
+        panel.compute_indicators()
+        print(f"全市场指标: {len(panel.dates)} 天 × {len(panel.symbols)} 只, 耗时 {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,199 @@
+#!/usr/bin/python3
+# providers.py
+
+import os
+import threading
+import time
+from collections import deque
+from fetch_pool import limiters
+from response_cache import ResponseCache, CACHE_DIR, MAX_BYTES
+from fixtures import FixtureStore, FIXTURE_DIR
+
+# 连续失败多少次打开熔断，打开后多久放一个试探请求
+FAIL_MAX = 5
+COOLDOWN = 60
+# 滚动统计的窗口：最近多少次、多少秒内的请求
+WINDOW_SIZE = 50
+WINDOW_SECONDS = 300
+# 没有统计数据的数据源按这个单次耗时(秒)估计
+DEFAULT_COST = 1.0
+
+# 响应缓存，默认关闭，enable_cache()后所有call()先查缓存
+response_cache = None
+
+def enable_cache(cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+    global response_cache
+    response_cache = ResponseCache(cache_dir, max_bytes)
+    return response_cache
+
+# 数据源模式: live 直连；record 直连并录制响应；replay 只从录制文件回放，不联网
+# 可用环境变量 MARKET_PROVIDER_MODE / MARKET_FIXTURE_DIR / MARKET_REPLAY_LATENCY 设置，
+# 这样 main.py、get_history.py、check_tushare.py 等入口不用改参数也能离线跑
+mode = 'live'
+fixture_store = None
+
+def set_mode(new_mode, fixture_dir=FIXTURE_DIR, latency=0.0):
+    """
+    参数:
+    new_mode: live / record / replay
+    latency: replay时每次请求模拟的耗时(秒)
+    """
+    global mode, fixture_store
+    if new_mode not in ('live', 'record', 'replay'):
+        raise ValueError(f"未知的数据源模式: {new_mode}")
+    mode = new_mode
+    fixture_store = None if new_mode == 'live' else FixtureStore(fixture_dir, latency)
+    return fixture_store
+
+set_mode(os.environ.get('MARKET_PROVIDER_MODE', 'live'),
+         os.environ.get('MARKET_FIXTURE_DIR', FIXTURE_DIR),
+         float(os.environ.get('MARKET_REPLAY_LATENCY', 0)))
+
+def call(provider, endpoint, func, **params):
+    """
+    行情接口调用的统一入口：先查响应缓存，未命中时按数据源限流后真正发请求
+    replay模式直接从录制文件取，record模式把拿到的结果写入录制文件
+
+    参数:
+    provider: 数据源名称，akshare / tushare / sina
+    endpoint: 接口名，和params一起作为缓存key
+    func: 实际调用的接口函数，func(**params)
+    """
+    if mode == 'replay':
+        return fixture_store.load(provider, endpoint, params)
+    value = fetch(provider, endpoint, func, params)
+    if mode == 'record':
+        fixture_store.save(provider, endpoint, params, value)
+    return value
+
+def fetch(provider, endpoint, func, params):
+    """查响应缓存，未命中时限流后调用接口"""
+    if response_cache is not None:
+        hit, value = response_cache.get(provider, endpoint, params)
+        if hit:
+            return value
+    if provider in limiters:
+        limiters[provider].acquire()
+    value = func(**params)
+    if response_cache is not None and value is not None:
+        response_cache.put(provider, endpoint, params, value)
+    return value
+
+class CircuitBreaker:
+    """熔断器：closed 正常放行，open 直接拒绝，冷却后 half_open 只放一个试探请求"""
+
+    def __init__(self, fail_max=FAIL_MAX, cooldown=COOLDOWN):
+        self.fail_max = fail_max
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def ready_to_probe(self):
+        """已经open且冷却结束，下一个请求可以试探"""
+        with self.lock:
+            return self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown
+
+    def allow(self):
+        with self.lock:
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    return False
+                self.state = 'half_open'
+                return True
+            # half_open 时试探请求还没回来，其余请求继续拒绝
+            return self.state == 'closed'
+
+    def success(self):
+        with self.lock:
+            self.state = 'closed'
+            self.failures = 0
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == 'half_open' or self.failures >= self.fail_max:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+class ProviderStats:
+    """单个数据源最近请求的耗时和成败"""
+
+    def __init__(self, size=WINDOW_SIZE, seconds=WINDOW_SECONDS):
+        self.samples = deque(maxlen=size)
+        self.seconds = seconds
+        self.lock = threading.Lock()
+
+    def add(self, ok, elapsed):
+        with self.lock:
+            self.samples.append((time.monotonic(), ok, elapsed))
+
+    def cost(self):
+        """
+        预计拿到一次成功结果的耗时 = 平均耗时 / 成功率（成功率做+1平滑，单次失败不至于直接判死）
+        窗口内没有样本时返回None
+        """
+        with self.lock:
+            now = time.monotonic()
+            recent = [(ok, el) for t, ok, el in self.samples if now - t <= self.seconds]
+        if not recent:
+            return None
+        success = (sum(ok for ok, _ in recent) + 1) / (len(recent) + 1)
+        latency = sum(el for _, el in recent) / len(recent)
+        return latency / success
+
+class ProviderRouter:
+    """按熔断状态和滚动耗时/错误率为每次请求挑选数据源顺序"""
+
+    def __init__(self, names, fail_max=FAIL_MAX, cooldown=COOLDOWN):
+        """
+        参数:
+        names: 数据源名称，按默认优先级排列
+        """
+        self.names = list(names)
+        self.breakers = {name: CircuitBreaker(fail_max, cooldown) for name in self.names}
+        self.stats = {name: ProviderStats() for name in self.names}
+
+    def order(self):
+        """冷却结束等待试探的排最前，其余按预计耗时排序，相同时保持默认优先级"""
+        def key(item):
+            i, name = item
+            cost = self.stats[name].cost()
+            return (not self.breakers[name].ready_to_probe(),
+                    DEFAULT_COST if cost is None else cost, i)
+        return [name for _, name in sorted(enumerate(self.names), key=key)]
+
+    def run(self, funcs):
+        """
+        依次尝试各数据源直到成功
+
+        参数:
+        funcs: {数据源名称: 无参函数}
+        """
+        last_error = None
+        for name in self.order():
+            if name not in funcs or not self.breakers[name].allow():
+                continue
+            # funcs内部经call()限流，耗时包含限流等待，配额吃紧的数据源会自然被排到后面
+            start = time.perf_counter()
+            try:
+                result = funcs[name]()
+            except Exception as e:
+                self.stats[name].add(False, time.perf_counter() - start)
+                self.breakers[name].failure()
+                last_error = e
+                continue
+            self.stats[name].add(True, time.perf_counter() - start)
+            self.breakers[name].success()
+            return result
+        raise last_error or RuntimeError('没有可用的数据源')
+
+    def report(self):
+        """各数据源的熔断状态和预计耗时"""
+        lines = []
+        for name in self.names:
+            cost = self.stats[name].cost()
+            cost_str = '无数据' if cost is None else f"{cost * 1000:.0f}ms"
+            lines.append(f"{name}: {self.breakers[name].state}, 预计耗时 {cost_str}")
+        return "\n".join(lines)
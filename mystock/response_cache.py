@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+# response_cache.py
+
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+import zlib
+from datetime import date
+from pathlib import Path
+
+CACHE_DIR = '/opt/zack/master/cache'
+MAX_BYTES = 2 * 1024 ** 3
+# 请求区间包含今天时的有效期(秒)；区间全在今天之前的历史数据永久有效
+# 有效期为0的接口(实时行情)不缓存，每次都直连
+ENDPOINT_TTL = {
+    'stock_zh_a_hist': 600,
+    'daily': 600,
+    'get_realtime_quotes': 0,
+}
+DEFAULT_TTL = 300
+
+class ResponseCache:
+    """
+    行情接口响应的磁盘缓存
+    按(数据源, 接口, 参数)做key，压缩pickle存盘，总大小超限时按最近使用时间淘汰
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0}
+        self.size = sum(p.stat().st_size for p in self.cache_dir.glob('*.pkl.z'))
+
+    def key_path(self, provider, endpoint, params):
+        key = json.dumps([provider, endpoint, sorted(params.items())], default=str, ensure_ascii=False)
+        return self.cache_dir / (hashlib.sha1(key.encode('utf-8')).hexdigest() + '.pkl.z')
+
+    def ttl(self, endpoint, params):
+        """区间结束日早于今天的永久缓存，否则用接口对应的短有效期"""
+        last = params.get('end_date') or params.get('trade_date')
+        if last and str(last).replace('-', '') < date.today().strftime('%Y%m%d'):
+            return None
+        return ENDPOINT_TTL.get(endpoint, DEFAULT_TTL)
+
+    def cacheable(self, endpoint):
+        return ENDPOINT_TTL.get(endpoint, DEFAULT_TTL) != 0
+
+    def get(self, provider, endpoint, params):
+        """返回 (是否命中, 值)；不缓存的接口直接返回未命中，不计入统计"""
+        if not self.cacheable(endpoint):
+            return False, None
+        path = self.key_path(provider, endpoint, params)
+        try:
+            with open(path, 'rb') as f:
+                expires, value = pickle.loads(zlib.decompress(f.read()))
+        except (FileNotFoundError, EOFError, zlib.error, pickle.UnpicklingError):
+            with self.lock:
+                self.stats['misses'] += 1
+            return False, None
+        if expires is not None and expires < time.time():
+            self.remove(path)
+            with self.lock:
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+            return False, None
+        # 刷新mtime作为最近使用时间
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        with self.lock:
+            self.stats['hits'] += 1
+        return True, value
+
+    def put(self, provider, endpoint, params, value):
+        if not self.cacheable(endpoint):
+            return
+        ttl = self.ttl(endpoint, params)
+        expires = None if ttl is None else time.time() + ttl
+        payload = zlib.compress(pickle.dumps((expires, value), protocol=pickle.HIGHEST_PROTOCOL), 3)
+        path = self.key_path(provider, endpoint, params)
+        tmp = path.with_name(f'{path.name}.{threading.get_ident()}.tmp')
+        with open(tmp, 'wb') as f:
+            f.write(payload)
+        old = path.stat().st_size if path.exists() else 0
+        os.replace(tmp, path)
+        with self.lock:
+            self.size += len(payload) - old
+            over = self.size > self.max_bytes
+        if over:
+            self.evict()
+
+    def remove(self, path):
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return
+        with self.lock:
+            self.size -= size
+
+    def evict(self):
+        """按最近使用时间从旧到新删除，直到总大小降到上限的90%"""
+        files = []
+        for path in self.cache_dir.glob('*.pkl.z'):
+            try:
+                files.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                continue
+        for _, path in sorted(files):
+            if self.size <= self.max_bytes * 0.9:
+                break
+            self.remove(path)
+            with self.lock:
+                self.stats['evictions'] += 1
+
+    def report(self):
+        with self.lock:
+            total = self.stats['hits'] + self.stats['misses']
+            rate = self.stats['hits'] / total if total else 0
+            return (f"响应缓存: 命中 {self.stats['hits']}, 未命中 {self.stats['misses']} "
+                    f"(过期 {self.stats['expired']}), 命中率 {rate:.1%}, "
+                    f"淘汰 {self.stats['evictions']}, 占用 {self.size / 1024 ** 2:.1f}MB")
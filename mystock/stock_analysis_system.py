@@ -7,21 +7,67 @@ import numpy as np
 from datetime import datetime, timedelta
 import argparse
 import os
+import json
+import hashlib
 import warnings
+import indicators
+import kernels
+from market_db import MarketDB
+from panel import Panel, is_panel
 warnings.filterwarnings('ignore')
 
+# 预处理后的紧凑列类型：股票代码用category，价格用float32
+# volume(手)和amount(千元)保持原单位和float64：float32对成交额精度不够，换成整数又会改变单位，
+# 与SqliteHistoryReader/PanelHistoryReader读出的不一致
+COMPACT_SCHEMA = {
+    'symbol': 'category',
+    'date': 'datetime64[ns]',
+    'open': 'float32',
+    'high': 'float32',
+    'low': 'float32',
+    'close': 'float32',
+    'pre_close': 'float32',
+    'change': 'float32',
+    'pct_change': 'float32',
+    'volume': 'float64',
+    'amount': 'float64',
+}
+# 预处理逻辑变化时加1，让旧的预处理快照失效
+SNAPSHOT_VERSION = 2
+
+def file_sha1(file_path):
+    h = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def apply_schema(df, schema):
+    """按schema转换列类型，schema为None时原样返回"""
+    if not schema:
+        return df
+    for col, dtype in schema.items():
+        if col in df.columns:
+            df[col] = df[col].astype(dtype)
+    return df
+
 class HistoryDataReader:
     """历史数据读取器"""
     
-    def __init__(self, file_path='history_20260101_20260201.csv'):
+    def __init__(self, file_path='history_20260101_20260201.csv', schema=COMPACT_SCHEMA, snapshot=True):
         """
         初始化历史数据读取器
         
         参数:
         file_path: 历史数据文件路径
+        schema: 预处理后的列类型，None时保持pandas默认的object/float64
+        snapshot: 是否使用预处理快照({file_path}.snapshot.pkl)，源文件没变时直接加载预处理结果
         """
         self.file_path = file_path
+        self.schema = schema
+        self.snapshot = snapshot
         self.data = None
+        self.symbol_rows = {}
         self.load_history_data()
     
     def load_history_data(self):
@@ -29,6 +75,9 @@ class HistoryDataReader:
         print(f"📂📂 正在加载历史数据文件: {self.file_path}")
         
         try:
+            if self.snapshot and self.load_snapshot():
+                return
+            
             # 读取CSV文件
             self.data = pd.read_csv(self.file_path, encoding='utf-8-sig')
             print(f"✅ 数据加载成功!")
@@ -38,6 +87,8 @@ class HistoryDataReader:
             
             # 数据清洗和预处理
             self.preprocess_data()
+            if self.snapshot:
+                self.save_snapshot()
             
         except FileNotFoundError:
             print(f"❌❌ 文件不存在: {self.file_path}")
@@ -45,6 +96,60 @@ class HistoryDataReader:
         except Exception as e:
             print(f"❌❌ 加载数据失败: {e}")
     
+    def snapshot_key(self, full=True):
+        """源文件的大小、修改时间和内容哈希，加上预处理版本和列类型；full=False时不算哈希"""
+        st = os.stat(self.file_path)
+        return {
+            'version': SNAPSHOT_VERSION,
+            'schema': json.dumps(self.schema, sort_keys=True),
+            'size': st.st_size,
+            'mtime': st.st_mtime_ns,
+            'sha1': file_sha1(self.file_path) if full else None,
+        }
+    
+    def load_snapshot(self):
+        """源文件没变时加载预处理快照，返回是否成功"""
+        meta_file = f'{self.file_path}.snapshot.json'
+        if not os.path.isfile(meta_file) or not os.path.isfile(self.file_path):
+            return False
+        with open(meta_file, encoding='utf-8') as f:
+            meta = json.load(f)
+        key = self.snapshot_key(full=False)
+        if any(meta.get(k) != key[k] for k in ('version', 'schema', 'size')):
+            return False
+        if meta.get('mtime') != key['mtime']:
+            # 只是修改时间变了(如被复制/touch)，内容哈希一致仍可用
+            key = self.snapshot_key()
+            if meta.get('sha1') != key['sha1']:
+                return False
+            meta['mtime'] = key['mtime']
+            with open(meta_file, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+        try:
+            self.data = pd.read_pickle(f'{self.file_path}.snapshot.pkl')
+        except Exception as e:
+            print(f"⚠️ 预处理快照读取失败，重新加载: {e}")
+            return False
+        self.index_symbols()
+        print(f"✅ 已加载预处理快照!")
+        print(f"   处理后形状: {self.data.shape}")
+        print(f"   时间范围: {self.data['date'].min()} 到 {self.data['date'].max()}")
+        print(f"   股票数量: {len(self.symbol_rows)}")
+        return True
+    
+    def save_snapshot(self):
+        """保存预处理结果，先写临时文件再改名"""
+        try:
+            key = self.snapshot_key()
+            pkl = f'{self.file_path}.snapshot.pkl'
+            self.data.to_pickle(pkl + '.tmp')
+            os.replace(pkl + '.tmp', pkl)
+            with open(f'{self.file_path}.snapshot.json.tmp', 'w', encoding='utf-8') as f:
+                json.dump(key, f)
+            os.replace(f'{self.file_path}.snapshot.json.tmp', f'{self.file_path}.snapshot.json')
+        except OSError as e:
+            print(f"⚠️ 预处理快照保存失败: {e}")
+    
     def preprocess_data(self):
         """数据预处理"""
         if self.data is None or self.data.empty:
@@ -95,9 +200,54 @@ class HistoryDataReader:
         if 'symbol' in self.data.columns and 'date' in self.data.columns:
             self.data = self.data.sort_values(['symbol', 'date']).reset_index(drop=True)
         
+        # 6. 紧凑列类型，并记录每只股票所在的行区间
+        self.data = apply_schema(self.data, self.schema)
+        self.index_symbols()
+        
         print(f"✅ 预处理完成")
         print(f"   处理后形状: {self.data.shape}")
         print(f"   可用列: {list(self.data.columns)}")
+        print(self.memory_report())
+    
+    def index_symbols(self):
+        """数据已按股票排序，记录每只股票的[起始行, 结束行)，取单只股票时直接切片"""
+        if 'symbol' not in self.data.columns or self.data.empty:
+            return
+        sym = self.data['symbol'].astype(str).to_numpy()
+        starts = np.flatnonzero(np.r_[True, sym[1:] != sym[:-1]])
+        ends = np.r_[starts[1:], len(sym)]
+        self.symbol_rows = {sym[s]: (s, e) for s, e in zip(starts, ends)}
+    
+    def memory_report(self):
+        """各列类型和占用内存"""
+        usage = self.data.memory_usage(deep=True, index=False)
+        lines = [f"   内存占用: {usage.sum() / 1024 ** 2:.1f}MB"]
+        for col in self.data.columns:
+            lines.append(f"     {col}: {self.data[col].dtype}, {usage[col] / 1024 ** 2:.1f}MB")
+        return "\n".join(lines)
+    
+    def precision_report(self, reference):
+        """
+        与float64的结果比较精度
+        
+        参数:
+        reference: schema=None加载的同一文件的HistoryDataReader
+        """
+        a, b = self.data, reference.data
+        lines = [f"   精度检查(对比 {reference.schema or 'float64'}):"]
+        for col in ['open', 'high', 'low', 'close', 'pre_close', 'change', 'pct_change', 'volume', 'amount']:
+            if col not in a.columns or col not in b.columns:
+                continue
+            x = a[col].to_numpy(dtype='float64')
+            y = b[col].to_numpy(dtype='float64')
+            err = np.abs(x - y)
+            rel = err / np.maximum(np.abs(y), 1e-12)
+            lines.append(f"     {col}: 最大绝对误差 {np.nanmax(err, initial=0):.3g}, 最大相对误差 {np.nanmax(rel, initial=0):.3g}")
+        if 'close' in a.columns:
+            ra = a.groupby('symbol', observed=True)['close'].pct_change().to_numpy(dtype='float64')
+            rb = b.groupby('symbol')['close'].pct_change().to_numpy(dtype='float64')
+            lines.append(f"     日收益率: 最大绝对误差 {np.nanmax(np.abs(ra - rb), initial=0):.3g}")
+        return "\n".join(lines)
 
     def get_stock_data(self, symbol, start_date=None, end_date=None):
         """
@@ -111,8 +261,12 @@ class HistoryDataReader:
         if self.data is None:
             return None
         
-        # 过滤指定股票
-        stock_data = self.data[self.data['symbol'] == symbol].copy()
+        # 按preprocess_data记录的行区间切出指定股票，不用扫描全表
+        if symbol not in self.symbol_rows:
+            print(f"⚠️ 未找到股票 {symbol} 的数据")
+            return None
+        start, end = self.symbol_rows[symbol]
+        stock_data = self.data.iloc[start:end]
         
         if stock_data.empty:
             print(f"⚠️ 未找到股票 {symbol} 的数据")
@@ -192,11 +346,134 @@ class HistoryDataReader:
         if isinstance(date, str):
             date = pd.to_datetime(date)
         
-        daily_data = self.data[self.data['date'] == date].copy()
+        daily_data = self.data[self.data['date'] == date]
         
         return daily_data
     
 
+class SqliteHistoryReader(HistoryDataReader):
+    """
+    从行情库(market_db)读取历史数据，启动时不加载全量
+    单只股票按(symbol, date)主键、单日全市场按date索引查询，返回格式与HistoryDataReader一致
+    """
+    
+    def __init__(self, db_path):
+        self.db = MarketDB(db_path)
+        super().__init__(db_path)
+    
+    def load_history_data(self):
+        """只读取概要信息"""
+        print(f"📂📂 正在打开行情库: {self.file_path}")
+        min_date, max_date = self.db.bar_date_range()
+        print(f"✅ 行情库打开成功!")
+        print(f"   时间范围: {min_date} 到 {max_date}")
+        print(f"   股票数量: {len(self.get_stock_list())}")
+    
+    def normalize(self, df):
+        """与preprocess_data相同的列名和日期处理，作用于查询结果"""
+        df = df.rename(columns={'ts_code': 'symbol', 'trade_date': 'date',
+                                'pct_chg': 'pct_change', 'vol': 'volume'})
+        df['date'] = pd.to_datetime(df['date'], format='%Y%m%d')
+        for col in ['open', 'high', 'low', 'close', 'volume', 'amount', 'pct_change']:
+            df[col] = df[col].ffill()
+        return df
+    
+    def get_stock_data(self, symbol, start_date=None, end_date=None):
+        start = pd.to_datetime(start_date).strftime('%Y%m%d') if start_date else None
+        end = pd.to_datetime(end_date).strftime('%Y%m%d') if end_date else None
+        stock_data = self.db.bars_for(symbol, start, end)
+        if stock_data.empty:
+            print(f"⚠️ 未找到股票 {symbol} 的数据")
+            return None
+        return self.normalize(stock_data).set_index('date')
+    
+    def get_multi_stock_data(self, symbols=None, start_date=None, end_date=None):
+        if symbols is None:
+            symbols = self.get_stock_list()[:10]  # 限制数量避免内存问题
+        stock_data_dict = {}
+        for symbol in symbols:
+            df = self.get_stock_data(symbol, start_date, end_date)
+            if df is not None and not df.empty:
+                stock_data_dict[symbol] = df
+        return stock_data_dict
+    
+    def get_date_range(self):
+        min_date, max_date = self.db.bar_date_range()
+        if min_date is None:
+            return None, None
+        return pd.to_datetime(min_date, format='%Y%m%d'), pd.to_datetime(max_date, format='%Y%m%d')
+    
+    def get_stock_list(self):
+        return self.db.bar_symbols()
+    
+    def get_daily_market_data(self, date):
+        date = pd.to_datetime(date)
+        return self.normalize(self.db.bars_on(date.strftime('%Y%m%d')))
+    
+
+class PanelHistoryReader(HistoryDataReader):
+    """
+    从内存映射面板(panel.py生成的目录)读取历史数据
+    打开时只读日期和代码字典，查询时只把用到的切片读进内存
+    """
+    
+    def __init__(self, panel_dir):
+        self.panel = Panel(panel_dir)
+        super().__init__(panel_dir)
+    
+    def load_history_data(self):
+        """只读取概要信息"""
+        print(f"📂📂 正在打开面板: {self.file_path}")
+        print(f"✅ 面板打开成功!")
+        print(f"   面板形状: {tuple(self.panel.meta['shape'])}")
+        print(f"   时间范围: {self.panel.dates[0]} 到 {self.panel.dates[-1]}")
+        print(f"   股票数量: {len(self.panel.symbols)}")
+    
+    def normalize(self, df):
+        """列名与preprocess_data处理后一致"""
+        df = df.rename(columns={'vol': 'volume'})
+        if 'pre_close' not in df.columns:
+            # 加入pre_close/change之前生成的面板，由收盘价推出
+            df['pre_close'] = df['close'].shift()
+            df['change'] = df['close'] - df['pre_close']
+        for col in ['open', 'high', 'low', 'close', 'volume', 'amount', 'pct_change']:
+            df[col] = df[col].ffill()
+        return df
+    
+    def get_stock_data(self, symbol, start_date=None, end_date=None):
+        stock_data = self.panel.symbol_frame(symbol, start_date, end_date)
+        if stock_data is None or stock_data.empty:
+            print(f"⚠️ 未找到股票 {symbol} 的数据")
+            return None
+        stock_data.insert(0, 'symbol', symbol)
+        return self.normalize(stock_data)
+    
+    def get_multi_stock_data(self, symbols=None, start_date=None, end_date=None):
+        if symbols is None:
+            symbols = self.get_stock_list()[:10]  # 限制数量避免内存问题
+        stock_data_dict = {}
+        for symbol in symbols:
+            df = self.get_stock_data(symbol, start_date, end_date)
+            if df is not None and not df.empty:
+                stock_data_dict[symbol] = df
+        return stock_data_dict
+    
+    def get_date_range(self):
+        if len(self.panel.dates) == 0:
+            return None, None
+        return pd.Timestamp(self.panel.dates[0]), pd.Timestamp(self.panel.dates[-1])
+    
+    def get_stock_list(self):
+        return self.panel.symbols.tolist()
+    
+    def get_daily_market_data(self, date):
+        daily_data = self.panel.date_frame(date).reset_index()
+        daily_data.insert(1, 'date', pd.to_datetime(date))
+        return self.normalize(daily_data)
+    
+
+
+
 class PricePointAnalyzer:
     """点位分析器（基于历史数据）"""
     
@@ -271,20 +548,13 @@ class PricePointAnalyzer:
     def calculate_support_resistance(self, data, window=20):
         """计算支撑位和阻力位"""
         closes = data['close']
-        highs = data['high']
-        lows = data['low']
-        
-        # 计算支撑位（局部低点）
-        support_levels = []
-        for i in range(window, len(lows) - window):
-            if lows.iloc[i] == lows.iloc[i-window:i+window].min():
-                support_levels.append(lows.iloc[i])
+        highs = data['high'].to_numpy('float64')
+        lows = data['low'].to_numpy('float64')
         
-        # 计算阻力位（局部高点）
-        resistance_levels = []
-        for i in range(window, len(highs) - window):
-            if highs.iloc[i] == highs.iloc[i-window:i+window].max():
-                resistance_levels.append(highs.iloc[i])
+        # 支撑位（局部低点）和阻力位（局部高点）
+        is_low, is_high = kernels.extremes(lows, highs, window)
+        support_levels = lows[is_low].tolist()
+        resistance_levels = highs[is_high].tolist()
         
         # 去重并排序
         support_levels = sorted(list(set(support_levels)))
@@ -333,14 +603,13 @@ class PricePointAnalyzer:
         if len(closes) < window:
             return {}
         
-        sma = closes.rolling(window=window).mean()
-        std = closes.rolling(window=window).std()
+        sma, std = indicators.rolling_mean_std(closes.iloc[-window:], window)
         
         return {
-            '布林带中轨': sma.iloc[-1],
-            '布林带上轨': sma.iloc[-1] + std.iloc[-1] * std_dev,
-            '布林带下轨': sma.iloc[-1] - std.iloc[-1] * std_dev,
-            '布林带宽度': (std.iloc[-1] * std_dev * 2) / sma.iloc[-1] if sma.iloc[-1] != 0 else 0
+            '布林带中轨': sma[-1],
+            '布林带上轨': sma[-1] + std[-1] * std_dev,
+            '布林带下轨': sma[-1] - std[-1] * std_dev,
+            '布林带宽度': (std[-1] * std_dev * 2) / sma[-1] if sma[-1] != 0 else 0
         }
     
     def generate_point_analysis_report(self):
@@ -745,17 +1014,7 @@ class RiskManager:
         if len(prices) < 2:
             return 0
         
-        peak = prices.iloc[0]
-        max_dd = 0
-        
-        for price in prices:
-            if price > peak:
-                peak = price
-            
-            drawdown = (peak - price) / peak
-            max_dd = max(max_dd, drawdown)
-        
-        return max_dd
+        return kernels.max_drawdown(prices.to_numpy('float64'))
     
     def calculate_var(self, returns, confidence=0.95):
         """计算风险价值 (VaR)"""
@@ -1280,14 +1539,15 @@ def example_technical_strategy(date, daily_data, context, strategy_type='technic
         
         # 计算技术指标
         closes = all_data['close']
-        ma5 = closes.rolling(5).mean()
-        ma20 = closes.rolling(20).mean()
+        # 只需要最后两天的均线
+        ma5 = indicators.ma(closes.iloc[-21:], 5)
+        ma20 = indicators.ma(closes.iloc[-21:], 20)
         
         current_price = closes.iloc[-1]
-        current_ma5 = ma5.iloc[-1]
-        current_ma20 = ma20.iloc[-1]
-        prev_ma5 = ma5.iloc[-2] if len(ma5) > 1 else current_ma5
-        prev_ma20 = ma20.iloc[-2] if len(ma20) > 1 else current_ma20
+        current_ma5 = ma5[-1]
+        current_ma20 = ma20[-1]
+        prev_ma5 = ma5[-2] if len(ma5) > 1 else current_ma5
+        prev_ma20 = ma20[-2] if len(ma20) > 1 else current_ma20
         
         # 生成交易信号
         if current_ma5 > current_ma20 and prev_ma5 <= prev_ma20:
@@ -1327,12 +1587,9 @@ def trend_following_strategy(date, daily_data, context, strategy_type='trend'):
             continue
         
         closes = all_data['close']
-        ma20 = closes.rolling(20).mean()
-        ma50 = closes.rolling(50).mean()
-        
         current_price = closes.iloc[-1]
-        current_ma20 = ma20.iloc[-1]
-        current_ma50 = ma50.iloc[-1]
+        current_ma20 = indicators.ma(closes.iloc[-20:], 20)[-1]
+        current_ma50 = indicators.ma(closes.iloc[-50:], 50)[-1]
         
         # 趋势判断
         if current_ma20 > current_ma50 and current_price > current_ma20:
@@ -1372,12 +1629,11 @@ def mean_reversion_strategy(date, daily_data, context, strategy_type='mean_rever
             continue
         
         closes = all_data['close']
-        ma20 = closes.rolling(20).mean()
-        std20 = closes.rolling(20).std()
+        ma20, std20 = indicators.rolling_mean_std(closes.iloc[-20:], 20)
         
         current_price = closes.iloc[-1]
-        current_ma20 = ma20.iloc[-1]
-        current_std = std20.iloc[-1]
+        current_ma20 = ma20[-1]
+        current_std = std20[-1]
         
         # 计算z-score
         if current_std > 0:
@@ -1411,13 +1667,27 @@ def main():
                        choices=['technical', 'trend', 'mean_reversion'])
     parser.add_argument('--backtest', action='store_true', help='是否运行回测')
     parser.add_argument('--capital', type=float, default=1000000, help='初始资金')
+    parser.add_argument('--float64', action='store_true', help='不压缩列类型，保持float64')
+    parser.add_argument('--check_precision', action='store_true', help='与float64加载结果比较精度')
+    parser.add_argument('--no_snapshot', action='store_true', help='不使用预处理快照，重新解析数据文件')
+    parser.add_argument('--ind_cache', action='store_true', help='缓存指标结果，相同输入和参数只算一次')
     args = parser.parse_args()
+    if args.ind_cache:
+        indicators.enable_cache()
     
     # 1. 加载数据
     data_file = args.data_file
-    data_reader = HistoryDataReader(data_file)
+    if data_file.endswith('.sqlite'):
+        data_reader = SqliteHistoryReader(data_file)
+    elif is_panel(data_file):
+        data_reader = PanelHistoryReader(data_file)
+    else:
+        data_reader = HistoryDataReader(data_file, schema=None if args.float64 else COMPACT_SCHEMA,
+                                        snapshot=not args.no_snapshot)
+        if args.check_precision and data_reader.schema:
+            print(data_reader.precision_report(HistoryDataReader(data_file, schema=None, snapshot=False)))
     
-    if data_reader.data is None:
+    if not data_reader.get_stock_list():
         print("❌❌ 无法加载数据，程序退出")
         return
     
@@ -1511,6 +1781,8 @@ def main():
             import traceback
             traceback.print_exc()
     
+    if indicators.cache is not None:
+        print(indicators.cache.report())
     print("\n" + "=" * 60)
     print("✅ 分析完成!")
     print("=" * 60)
@@ -0,0 +1,324 @@
+#!/usr/bin/python3
+# store.py
+
+import os
+import io
+import time
+import shutil
+import argparse
+import threading
+import pandas as pd
+from pathlib import Path
+from manifest import Manifest, MANIFEST_FILE
+from market_db import MarketDB, DB_FILE
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+DATA_DIR = '/opt/zack/master/data'
+# 存储格式，可用环境变量 MARKET_STORE 指定；不指定时见open_store
+STORE_FORMAT = os.environ.get('MARKET_STORE')
+PARQUET_COMPRESSION = 'zstd'
+# parquet增量文件攒到这么多个就合并回主文件
+COMPACT_PARTS = 20
+
+class FileStore:
+    """
+    每只股票一个文件的存储，子类实现具体格式
+    每次write/append后同步更新目录下的清单(manifest.sqlite)，last_date/last_row/latest优先查清单
+    """
+
+    suffix = ''
+
+    def __init__(self, data_dir=DATA_DIR):
+        self.data_dir = Path(data_dir)
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest = Manifest(self.data_dir / MANIFEST_FILE)
+
+    def path(self, sn):
+        return self.data_dir / f'{sn}{self.suffix}'
+
+    def exists(self, sn):
+        return self.path(sn).is_file()
+
+    def symbols(self):
+        return sorted(p.name[:-len(self.suffix)] for p in self.data_dir.glob(f'*{self.suffix}'))
+
+    def write(self, sn, df, lineage=None, state=None):
+        """
+        参数:
+        lineage: 派生列的来源记录，None时保留清单里原来的记录
+        state: 写入后流式指标的状态，None时作废原来的状态
+        """
+        self.write_data(sn, df)
+        self.manifest.replace(sn, df, lineage, state)
+
+    def lineage(self, sn):
+        return self.manifest.lineage(sn)
+
+    def state(self, sn):
+        return self.manifest.state(sn)
+
+    def append(self, sn, rows, state=None):
+        self.append_data(sn, rows)
+        if not self.manifest.append(sn, rows, state):
+            self.manifest.replace(sn, self.read(sn), state=state)
+
+    def remove(self, sn):
+        self.remove_data(sn)
+        self.manifest.remove(sn)
+
+    def remove_data(self, sn):
+        self.path(sn).unlink()
+
+    def disk_bytes(self):
+        return sum(p.stat().st_size for p in self.data_dir.rglob(f'*{self.suffix}'))
+
+    def last_date(self, sn):
+        entry = self.manifest.get(sn)
+        return entry[0] if entry is not None else self.file_last_date(sn)
+
+    def last_dates(self):
+        """{sn: 最后日期}，清单里没有的股票读文件补上"""
+        dates = self.manifest.last_dates()
+        for sn in self.symbols():
+            if sn not in dates:
+                last = self.file_last_date(sn)
+                if last:
+                    dates[sn] = last
+        return dates
+
+    def last_row(self, sn):
+        """最后一行的Series，空文件返回None"""
+        entry = self.manifest.get(sn)
+        if entry is not None:
+            return pd.Series(entry[3], name=entry[1] - 1) if entry[1] else None
+        return self.file_last_row(sn)
+
+    def latest(self, sns):
+        """一次查询取多只股票的最后一行，以sn为索引"""
+        df = self.manifest.latest(sns)
+        missing = [sn for sn in sns if sn not in df.index and self.exists(sn)]
+        if missing:
+            df = pd.concat([df, pd.DataFrame({sn: self.file_last_row(sn) for sn in missing}).T])
+        return df.reindex(sns)
+
+    def reindex_manifest(self):
+        """按数据文件重建清单，迁移老数据或清单丢失时使用"""
+        for sn in self.symbols():
+            self.manifest.replace(sn, self.read(sn))
+
+class CsvStore(FileStore):
+    """原来的每只股票一个 utf-8-sig csv，date列为YYYY-MM-DD字符串"""
+
+    suffix = '.csv'
+
+    def read(self, sn, columns=None):
+        return pd.read_csv(self.path(sn), encoding='utf-8-sig', usecols=columns, float_precision='round_trip')
+
+    def write_data(self, sn, df):
+        path = self.path(sn)
+        tmp = path.with_name(f'{path.name}.{threading.get_ident()}.tmp')
+        df.to_csv(tmp, index=False, encoding='utf-8-sig')
+        os.replace(tmp, path)
+
+    def append_data(self, sn, rows):
+        """只把新行追加到文件末尾，列顺序按文件表头"""
+        header = pd.read_csv(self.path(sn), encoding='utf-8-sig', nrows=0).columns
+        rows.reindex(columns=header).to_csv(self.path(sn), mode='a', header=False, index=False, encoding='utf-8')
+
+    def tail_lines(self, sn):
+        """只读表头和文件末尾4KB，避免解析整个文件"""
+        with open(self.path(sn), 'rb') as f:
+            header = f.readline()
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 4096))
+            lines = f.read().strip().splitlines()
+        return header, lines
+
+    def file_last_date(self, sn):
+        header, lines = self.tail_lines(sn)
+        if not lines or lines[-1] == header.strip():
+            return None
+        return lines[-1].decode('utf-8', errors='ignore').split(',')[0]
+
+    def file_last_row(self, sn):
+        header, lines = self.tail_lines(sn)
+        if not lines or lines[-1] == header.strip():
+            return None
+        return pd.read_csv(io.BytesIO(header + lines[-1]), encoding='utf-8-sig').iloc[0]
+
+class ParquetStore(FileStore):
+    """
+    每只股票一个parquet文件，列带类型，date存为date32
+    读出时date转回YYYY-MM-DD字符串，和csv格式的行为保持一致
+    parquet不能原地追加，增量行写成 {sn}.delta/ 下的小文件，读取时拼在主文件后面，
+    攒够COMPACT_PARTS个再合并回主文件
+    """
+
+    suffix = '.parquet'
+
+    def __init__(self, data_dir=DATA_DIR):
+        if pq is None:
+            raise ImportError('parquet存储需要安装pyarrow')
+        super().__init__(data_dir)
+
+    def delta_dir(self, sn):
+        return self.data_dir / f'{sn}.delta'
+
+    def parts(self, sn):
+        """主文件和增量文件，按写入顺序"""
+        return [self.path(sn)] + sorted(self.delta_dir(sn).glob('*.parquet'))
+
+    def read_file(self, path, columns=None):
+        df = pq.read_table(path, columns=columns).to_pandas()
+        if 'date' in df.columns:
+            df['date'] = df['date'].to_numpy().astype('datetime64[D]').astype(str)
+        return df
+
+    def read(self, sn, columns=None):
+        frames = [self.read_file(path, columns) for path in self.parts(sn)]
+        return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+    def write_file(self, path, df):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f'{path.name}.{threading.get_ident()}.tmp')
+        out = df.copy()
+        out['date'] = pd.to_datetime(out['date']).to_numpy().astype('datetime64[D]')
+        out.to_parquet(tmp, index=False, engine='pyarrow', compression=PARQUET_COMPRESSION)
+        os.replace(tmp, path)
+
+    def write_data(self, sn, df):
+        self.write_file(self.path(sn), df)
+        shutil.rmtree(self.delta_dir(sn), ignore_errors=True)
+
+    def append_data(self, sn, rows):
+        parts = self.parts(sn)
+        if len(parts) > COMPACT_PARTS:
+            self.write_data(sn, pd.concat([self.read(sn), rows], ignore_index=True))
+            return
+        columns = pq.read_schema(parts[0]).names
+        self.write_file(self.delta_dir(sn) / f'{len(parts):06d}.parquet', rows.reindex(columns=columns))
+
+    def remove_data(self, sn):
+        shutil.rmtree(self.delta_dir(sn), ignore_errors=True)
+        super().remove_data(sn)
+
+    def file_last_date(self, sn):
+        df = self.read_file(self.parts(sn)[-1], columns=['date'])
+        return df['date'].iloc[-1] if len(df) else None
+
+    def file_last_row(self, sn):
+        """只读最后一个文件的最后一个row group"""
+        f = pq.ParquetFile(self.parts(sn)[-1])
+        if f.metadata.num_rows == 0:
+            return None
+        df = f.read_row_group(f.num_row_groups - 1).to_pandas()
+        df['date'] = df['date'].to_numpy().astype('datetime64[D]').astype(str)
+        return df.iloc[-1]
+
+class SqliteStore(FileStore):
+    """每只股票的res存在行情库(market_db)的series表里，主键(symbol, date)"""
+
+    def __init__(self, data_dir=DATA_DIR, db_path=DB_FILE):
+        super().__init__(data_dir)
+        self.db = MarketDB(db_path)
+
+    def path(self, sn):
+        return Path(self.db.db_path)
+
+    def exists(self, sn):
+        return self.db.has_series(sn)
+
+    def symbols(self):
+        return self.db.series_symbols()
+
+    def read(self, sn, columns=None):
+        return self.db.get_series(sn, columns)
+
+    def write_data(self, sn, df):
+        self.db.put_series(sn, df, replace=True)
+
+    def append_data(self, sn, rows):
+        self.db.put_series(sn, rows)
+
+    def remove_data(self, sn):
+        self.db.delete_series(sn)
+
+    def disk_bytes(self):
+        return sum(p.stat().st_size for p in Path(self.db.db_path).parent.glob(Path(self.db.db_path).name + '*'))
+
+    def file_last_date(self, sn):
+        row = self.db.last_series_row(sn)
+        return None if row is None else row['date']
+
+    def file_last_row(self, sn):
+        return self.db.last_series_row(sn)
+
+STORES = {'csv': CsvStore, 'parquet': ParquetStore, 'sqlite': SqliteStore}
+# 已经提示过需要迁移的目录
+hinted = set()
+
+def open_store(kind=STORE_FORMAT, data_dir=DATA_DIR):
+    """
+    kind为None时：有pyarrow用parquet；目录里只有还没迁移的csv时继续用csv并提示迁移
+    """
+    if kind is None:
+        kind = 'parquet' if pq is not None else 'csv'
+        if kind == 'parquet' and not any(Path(data_dir).glob('*.parquet')) and any(Path(data_dir).glob('*.csv')):
+            if data_dir not in hinted:
+                hinted.add(data_dir)
+                print(f"{data_dir} 下还是csv数据，可用 python store.py --migrate 转换为parquet")
+            kind = 'csv'
+    return STORES[kind](data_dir)
+
+def migrate(src='csv', dst='parquet', data_dir=DATA_DIR, remove=False):
+    """
+    把data_dir下src格式的数据整体转换成dst格式，已存在的dst文件跳过
+    转换后逐只回读比对，一致才删除源文件(remove=True时)
+    """
+    src_store, dst_store = STORES[src](data_dir), STORES[dst](data_dir)
+    src_bytes, done = src_store.disk_bytes(), 0
+    for sn in src_store.symbols():
+        if dst_store.exists(sn):
+            continue
+        df = src_store.read(sn)
+        dst_store.write(sn, df)
+        back = dst_store.read(sn)
+        if not back.equals(df.astype(back.dtypes.to_dict())):
+            print(f"{sn}: 转换后数据不一致，保留源文件")
+            continue
+        done += 1
+        if remove:
+            src_store.remove_data(sn)
+    print(f"转换 {done} 只: {src_bytes / 1024 ** 2:.1f}MB -> {dst_store.disk_bytes() / 1024 ** 2:.1f}MB")
+
+def load_all(store, columns=None):
+    """整个目录读入内存，返回 {sn: DataFrame} 和耗时"""
+    start = time.perf_counter()
+    frames = {sn: store.read(sn, columns) for sn in store.symbols()}
+    return frames, time.perf_counter() - start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--migrate', action="store_const", const=True, default = False)
+    parser.add_argument('--src', type=str, default = 'csv')
+    parser.add_argument('--dst', type=str, default = 'parquet')
+    parser.add_argument('--dir', type=str, default = DATA_DIR)
+    parser.add_argument('--rm', action="store_const", const=True, default = False)
+    parser.add_argument('--bench', action="store_const", const=True, default = False)
+    parser.add_argument('--index', action="store_const", const=True, default = False)
+    args = parser.parse_args()
+    if args.migrate:
+        migrate(args.src, args.dst, args.dir, args.rm)
+    if args.index:
+        start = time.perf_counter()
+        st = open_store(data_dir=args.dir)
+        st.reindex_manifest()
+        print(f"清单已重建: {len(st.symbols())} 只, 耗时 {time.perf_counter() - start:.1f}s")
+    if args.bench:
+        for kind in (args.src, args.dst):
+            frames, elapsed = load_all(STORES[kind](args.dir))
+            print(f"{kind}: {len(frames)} 只, 全量读取 {elapsed:.2f}s")
@@ -3,6 +3,7 @@
 import matplotlib.pyplot as plt
 import pandas as pd
 import numpy as np
+import kernels
 
 class signal:
     def __init__(self):
@@ -61,15 +62,8 @@ class signal:
         df = df.copy()
         
         # 建立仓位（1持仓，0空仓）
-        df['position'] = 0
-        current_position = 0
-        
-        for i in range(len(df)):
-            if df.loc[i,'signal'] == 1:  # 买入信号
-                current_position = 1
-            elif df.loc[i,'signal'] == -1:  # 卖出信号
-                current_position = 0
-            df.loc[i, df.columns.get_loc('position')] = current_position
+        # 买入信号(1)持仓，卖出信号(-1)空仓，其余日子保持前一天的仓位
+        df['position'] = kernels.positions(df['signal'].to_numpy('float64'))
         
         # 计算收益率
         df['returns'] = df['value'].pct_change()
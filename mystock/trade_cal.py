@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+# trade_cal.py
+
+import pandas as pd
+import tushare as ts
+from bisect import bisect_left, bisect_right
+from datetime import datetime as dt, timedelta
+from pathlib import Path
+import argparse
+import providers
+
+CAL_FILE = '/opt/zack/master/trade_cal.csv'
+# 收盘后tushare日线一般要到这个时间才齐
+DATA_READY_TIME = '16:00'
+
+class TradeCalendar:
+    """交易日历（来自 pro.trade_cal，缓存在本地csv，日期均为YYYYMMDD字符串）"""
+
+    def __init__(self, cal_file=CAL_FILE, pro=None):
+        """
+        参数:
+        cal_file: 本地缓存文件
+        pro: tushare pro_api，缓存不覆盖所需日期时用它补拉；为None时只用本地缓存
+        """
+        self.cal_file = cal_file
+        self.pro = pro
+        self.days = []
+        self.end = None
+        self.tried = False
+        self.load()
+
+    def load(self):
+        """读取本地缓存"""
+        if Path(self.cal_file).is_file():
+            df = pd.read_csv(self.cal_file, dtype=str)
+            self.days = sorted(df.loc[df['is_open'] == '1', 'cal_date'])
+            self.end = df['cal_date'].max()
+
+    def refresh(self, start_date='20100101', end_date=None):
+        """从 pro.trade_cal 拉取日历并覆盖本地缓存（需要联网）"""
+        end_date = end_date or f'{dt.now().year}1231'
+        pro = self.pro or ts.pro_api()
+        df = providers.call('tushare', 'trade_cal', pro.trade_cal, exchange='SSE',
+                            start_date=start_date, end_date=end_date, fields='cal_date,is_open')
+        if df is None or df.empty:
+            print(f"交易日历为空: {start_date} - {end_date}")
+            return
+        df = df.astype(str).sort_values('cal_date')
+        Path(self.cal_file).parent.mkdir(parents=True, exist_ok=True)
+        df.to_csv(self.cal_file, index=False)
+        print(f"交易日历已更新到 {self.cal_file}: {df['cal_date'].min()} - {df['cal_date'].max()}")
+        self.load()
+
+    def ensure(self, end_date):
+        """缓存没覆盖到end_date时尝试补拉，失败就继续用已有缓存"""
+        if self.end is not None and self.end >= end_date:
+            return True
+        if self.pro is None or self.tried:
+            return False
+        # 每个实例只补拉一次，断网时不反复重试
+        self.tried = True
+        try:
+            self.refresh(end_date=max(end_date, f'{dt.now().year}1231'))
+        except Exception as e:
+            print(f"交易日历更新失败: {e}")
+        return self.end is not None and self.end >= end_date
+
+    def is_open(self, day):
+        """day是否为交易日；缓存不覆盖时按工作日估计"""
+        if not self.ensure(day):
+            return dt.strptime(day, '%Y%m%d').weekday() < 5
+        i = bisect_left(self.days, day)
+        return i < len(self.days) and self.days[i] == day
+
+    def sessions(self, start_date, end_date):
+        """[start_date, end_date] 内的交易日列表"""
+        if not self.ensure(end_date):
+            return [d.strftime('%Y%m%d') for d in pd.bdate_range(start_date, end_date)]
+        return self.days[bisect_left(self.days, start_date):bisect_right(self.days, end_date)]
+
+    def last_session(self, now=None):
+        """最近一个已经收盘且数据可取的交易日"""
+        now = now or dt.now()
+        day = now.strftime('%Y%m%d')
+        if self.is_open(day) and now.strftime('%H:%M') >= DATA_READY_TIME:
+            return day
+        prev = now - timedelta(days=1)
+        while not self.is_open(prev.strftime('%Y%m%d')):
+            prev -= timedelta(days=1)
+        return prev.strftime('%Y%m%d')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--start_date', '-s', type=str, default = '20100101')
+    parser.add_argument('--end_date', '-e', type=str, default = f'{dt.now().year}1231')
+    args = parser.parse_args()
+    ts.set_token('5c940b85806741e9a4aedd3495a9fd43c11a0542d4b3ad641c1ef949')
+    TradeCalendar(pro=ts.pro_api()).refresh(args.start_date, args.end_date)
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+# transport.py
+
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+POOL_SIZE = 16
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 20
+RETRY_TOTAL = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+class Transport:
+    """
+    akshare/tushare共用的HTTP传输层
+    keep-alive连接池、连接/读取超时、429和5xx指数退避重试，并按host统计耗时
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                 retries=RETRY_TOTAL, backoff=RETRY_BACKOFF):
+        """
+        参数:
+        pool_size: 每个host保持的连接数，应不小于并发worker数
+        timeout: (连接超时, 读取超时)秒，调用方没传timeout时使用
+        retries: 最大重试次数
+        backoff: 退避系数，第n次重试前等待 backoff * 2^(n-1) 秒
+        """
+        self.session = requests.Session()
+        self.session.trust_env = False  # 忽略系统代理
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUS,
+                      allowed_methods=None, respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.timeout = timeout
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.originals = None
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        host = urlsplit(url).netloc
+        start = time.perf_counter()
+        ok = False
+        try:
+            resp = self.session.request(method, url, **kwargs)
+            ok = resp.status_code < 400
+            return resp
+        finally:
+            self.record(host, time.perf_counter() - start, ok)
+
+    def get(self, url, params=None, **kwargs):
+        return self.request('GET', url, params=params, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.request('POST', url, data=data, json=json, **kwargs)
+
+    def record(self, host, elapsed, ok):
+        """记录一次请求的耗时（含重试）"""
+        with self.lock:
+            st = self.stats.setdefault(host, {'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0})
+            st['count'] += 1
+            st['errors'] += 0 if ok else 1
+            st['total'] += elapsed
+            st['max'] = max(st['max'], elapsed)
+
+    def report(self):
+        """按host输出请求数、失败数、平均/最大耗时"""
+        lines = []
+        with self.lock:
+            for host, st in sorted(self.stats.items()):
+                avg = st['total'] / st['count'] if st['count'] else 0
+                lines.append(f"{host}: {st['count']} 次, 失败 {st['errors']}, "
+                             f"平均 {avg * 1000:.0f}ms, 最大 {st['max'] * 1000:.0f}ms")
+        return "\n".join(lines)
+
+    def install(self):
+        """
+        让akshare和tushare内部直接调用的 requests.get / requests.post 走这个传输层
+        两个库都没有注入session的接口，只能替换模块函数，uninstall可还原
+        """
+        if self.originals is None:
+            self.originals = (requests.get, requests.post)
+            requests.get = self.get
+            requests.post = self.post
+
+    def uninstall(self):
+        if self.originals is not None:
+            requests.get, requests.post = self.originals
+            self.originals = None